@@ -2,15 +2,21 @@
 ASGI config for core project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+GET requests to the read-heavy posts endpoints are served by
+posts.asgi.ReadPathApplication, everything else by the WSGI application.
 
 For more information on this file, see
-https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
+https://docs.djangoproject.com/en/2.2/howto/deployment/
 """
 
 import os
 
-from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
-application = get_asgi_application()
+django_application = get_wsgi_application()
+
+from posts.asgi import ReadPathApplication  # noqa: E402, needs the app registry
+
+application = ReadPathApplication(django_application)
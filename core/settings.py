@@ -36,6 +36,7 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    'posts.middleware.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
 
     'django.middleware.security.SecurityMiddleware',
@@ -160,3 +161,104 @@ JWT_AUTH = {
     'JWT_ISSUER': 'https://dev-7jqnzazt.auth0.com/',
     'JWT_AUTH_HEADER_PREFIX': 'Bearer',
 }
+
+# Auth0 signing keys, cached in posts.utils.jwks_store.
+# Set JWKS_PATH to a local JWKS file to verify tokens offline.
+
+JWKS_URL = 'https://dev-7jqnzazt.auth0.com/.well-known/jwks.json'
+JWKS_PATH = os.environ.get('JWKS_PATH', None)
+JWKS_TTL = 60 * 60
+JWKS_MIN_REFRESH_INTERVAL = 30
+
+# Verified bearer token claims kept in posts.utils.token_cache
+
+JWT_TOKEN_CACHE_SIZE = 1024
+
+# How many previous/next hops PostSerializer follows for each post
+
+POST_LINK_DEPTH = 1
+
+# Previous/next links follow the author's posts, or with this set, the
+# author's posts in the post's first category, see posts/links.py
+
+POST_LINKS_PER_CATEGORY = False
+
+# Cursor pagination of the posts feed and comments
+
+POSTS_PAGE_SIZE = 10
+COMMENTS_PAGE_SIZE = 20
+PROFILE_PAGE_SIZE = 10
+
+# Replies deeper than this are attached next to their parent
+
+COMMENT_MAX_DEPTH = 20
+MAX_PAGE_SIZE = 100
+
+# Post views are buffered and written in batches by posts.buffers,
+# set POST_VIEW_SYNC to write them during the request instead
+
+POST_VIEW_SYNC = False
+POST_VIEW_FLUSH_SIZE = 100
+POST_VIEW_FLUSH_INTERVAL = 5
+
+# Engagement events (views, likes, unlikes, comments) are logged in
+# batches the same way, and counted by the rollup_engagement command
+
+ENGAGEMENT_EVENTS_SYNC = False
+ENGAGEMENT_EVENTS_FLUSH_SIZE = 500
+ENGAGEMENT_EVENTS_FLUSH_INTERVAL = 5
+# seconds an event waits before it is counted, longer than any flush
+# takes to commit: batches written by other processes can commit after
+# events with higher ids
+ENGAGEMENT_ROLLUP_LAG = 60
+
+# Related posts and recommendations, precomputed by the
+# compute_related_posts command, see posts/recommendations.py
+
+RELATED_POSTS_COUNT = 5
+RELATED_POSTS_WORKERS = 4
+RELATED_CATEGORY_WEIGHT = 0.5
+# posts of a category scored against the posts in it, newest first
+RELATED_CATEGORY_CANDIDATES = 200
+RECOMMENDATION_SEED_POSTS = 10
+
+# Versioned API response cache, see posts/cache.py
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = 60 * 5
+
+# GET endpoints build their output with posts.api.fast instead of DRF
+# serializers, the output is the same
+
+FAST_SERIALIZERS = True
+
+# Resized WebP/JPEG copies of post thumbnails and profile images,
+# set IMAGE_VARIANTS_SYNC to make them during the request instead
+
+IMAGE_VARIANT_WIDTHS = [320, 640, 1280]
+IMAGE_VARIANT_WORKERS = 2
+IMAGE_VARIANTS_SYNC = False
+
+# Rendered post content, see posts/rendering.py
+
+POST_EXCERPT_LENGTH = 300
+WORDS_PER_MINUTE = 200
+
+# Threads serving the ASGI read path, see posts/asgi.py
+
+ASYNC_READ_WORKERS = 8
+
+# Request metrics and sampled profiling, see posts/middleware.py.
+# Set REQUEST_PROFILE_SAMPLE_RATE (0 to 1) to profile that fraction of
+# requests and keep the profiles of those slower than the threshold.
+
+REQUEST_METRICS_WINDOW = 1000
+REQUEST_PROFILE_SAMPLE_RATE = 0.0
+REQUEST_PROFILE_THRESHOLD_MS = 500
+REQUEST_PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
@@ -0,0 +1,238 @@
+from django.conf import settings
+from rest_framework import serializers
+
+from posts.images import srcset
+from posts.metrics import request_metrics
+from posts.rendering import load_toc
+from .pagination import ReadingListCursorPagination, MyPostsCursorPagination, paginate_section
+from .serializers import (
+    PostSerializer, PostSummarySerializer, CommentPreviews, PostLinks, RelatedPosts
+)
+
+# Read-only fast path for the GET endpoints. These build the exact output
+# of the serializers in serializers.py as plain dicts, with the field
+# accessors worked out once per serializer instead of once per object.
+# Keep both in step, posts/tests.py compares their output.
+
+_datetime_field = serializers.DateTimeField()
+
+
+def datetime_data(value):
+    if not value:
+        return None
+    return _datetime_field.to_representation(value)
+
+
+def file_data(value, request=None):
+    # same as rest_framework.fields.FileField.to_representation
+    if not value:
+        return None
+    try:
+        url = value.url
+    except AttributeError:
+        return None
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def user_data(user):
+    return {
+        'id': user.id,
+        'username': user.username,
+    }
+
+
+def author_data(author):
+    return {
+        'id': author.id,
+        'user': user_data(author.user),
+        'profile_image': file_data(author.profile_image),
+        'profile_image_srcset': srcset(author.profile_image_variants),
+    }
+
+
+def category_data(category):
+    return {
+        'id': category.id,
+        'title': category.title,
+    }
+
+
+def comment_data(comment):
+    return {
+        'id': comment.id,
+        'user': user_data(comment.user),
+        'timestamp': datetime_data(comment.timestamp),
+        'content': comment.content,
+        'parent': comment.parent_id,
+        'depth': comment.depth,
+        'reply_count': comment.reply_count,
+    }
+
+
+def post_link_data(post):
+    if post is None:
+        return {'title': '', 'thumbnail': None}
+    return {
+        'id': post.id,
+        'title': post.title,
+        'thumbnail': file_data(post.thumbnail),
+        'timestamp': datetime_data(post.timestamp),
+    }
+
+
+class FastPostLinks(PostLinks):
+    def link_data(self, post):
+        return post_link_data(post)
+
+
+class FastRelatedPosts(RelatedPosts):
+    def link_data(self, post):
+        return post_link_data(post)
+
+
+class FastSerializer:
+    # the part of the DRF serializer interface the generic views use
+
+    def __init__(self, instance=None, many=False, context=None, **kwargs):
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+
+    @property
+    def request(self):
+        return self.context.get('request', None)
+
+    @property
+    def data(self):
+        with request_metrics.serializer_timer():
+            if self.many:
+                instances = list(self.instance)
+                self.prepare(instances)
+                return [self.to_representation(instance) for instance in instances]
+            self.prepare([self.instance])
+            return self.to_representation(self.instance)
+
+    def prepare(self, instances):
+        pass
+
+    def to_representation(self, instance):
+        raise NotImplementedError
+
+
+class FastCategorySerializer(FastSerializer):
+    def to_representation(self, instance):
+        return category_data(instance)
+
+
+class FastCategoryIndexSerializer(FastSerializer):
+    def to_representation(self, instance):
+        return dict(
+            category_data(instance),
+            post_count=instance.post_count,
+            latest_post_at=datetime_data(instance.latest_post_at),
+        )
+
+
+class FastCommentSerializer(FastSerializer):
+    def to_representation(self, instance):
+        return comment_data(instance)
+
+
+class FastPostSerializer(FastSerializer):
+    def get_fields(self):
+        return PostSerializer.Meta.fields
+
+    def prepare(self, posts):
+        request = self.request
+        depth = self.context.get('post_link_depth', settings.POST_LINK_DEPTH)
+        links = None
+        fields = self.get_fields()
+        if 'previous_post' in fields or 'next_post' in fields:
+            links = FastPostLinks(posts, depth)
+        related = None
+        if 'related_posts' in fields:
+            related = FastRelatedPosts(posts)
+        comments = None
+        if 'comments' in fields or 'comments_next' in fields:
+            comments = CommentPreviews(posts, request)
+
+        accessors = {
+            'id': lambda post: post.id,
+            'title': lambda post: post.title,
+            'overview': lambda post: post.overview,
+            'timestamp': lambda post: datetime_data(post.timestamp),
+            'author': lambda post: author_data(post.author),
+            'thumbnail': lambda post: file_data(post.thumbnail, request),
+            'thumbnail_srcset': lambda post: srcset(post.thumbnail_variants, request),
+            'category': lambda post: [
+                category_data(category) for category in post.category.all()],
+            'featured': lambda post: post.featured,
+            'content': lambda post: post.content,
+            'content_html': lambda post: post.content_html,
+            'excerpt': lambda post: post.excerpt,
+            'word_count': lambda post: post.word_count,
+            'reading_time': lambda post: post.reading_time,
+            'toc': lambda post: load_toc(post.toc),
+            'previous_post': lambda post: links.get(post.previous_post_id, depth),
+            'next_post': lambda post: links.get(post.next_post_id, depth),
+            'related_posts': lambda post: related.get(post.id),
+            'comments': lambda post: [
+                comment_data(comment) for comment in comments.get(post.id)],
+            'comments_next': lambda post: comments.next_link(post.id),
+            'likes': lambda post: post.likes,
+            'view_count': lambda post: post.view_count,
+            'comment_count': lambda post: post.comment_count,
+        }
+        self.accessors = [(field, accessors[field]) for field in fields]
+
+    def to_representation(self, instance):
+        return {field: accessor(instance) for field, accessor in self.accessors}
+
+
+class FastPostSummarySerializer(FastPostSerializer):
+    def get_fields(self):
+        return PostSummarySerializer.requested_fields(self.request)
+
+
+class FastUserProfileSerializer(FastSerializer):
+    def to_representation(self, instance):
+        return {
+            'id': instance.id,
+            'user': user_data(instance.user),
+            'reading_list': self.get_section(
+                ReadingListCursorPagination,
+                instance.reading_list.select_related('post').only(
+                    'id', 'timestamp', 'post__id', 'post__title', 'post__thumbnail',
+                    'post__timestamp'),
+                lambda post_view: {
+                    'id': post_view.id,
+                    'timestamp': datetime_data(post_view.timestamp),
+                    'post': post_link_data(post_view.post),
+                }),
+            'my_posts': self.get_section(
+                MyPostsCursorPagination,
+                instance.my_posts.only('id', 'title', 'thumbnail', 'timestamp'),
+                post_link_data),
+        }
+
+    def get_section(self, pagination_class, queryset, item_data):
+        page, next_link, previous_link = paginate_section(
+            pagination_class, queryset, self.request)
+        return {
+            'next': next_link,
+            'previous': previous_link,
+            'results': [item_data(item) for item in page],
+        }
+
+
+class FastReadMixin:
+    # GET requests use fast_serializer_class, unless FAST_SERIALIZERS is off
+
+    fast_serializer_class = None
+
+    def get_serializer_class(self):
+        if self.request.method == 'GET' and getattr(settings, 'FAST_SERIALIZERS', True):
+            return self.fast_serializer_class
+        return super().get_serializer_class()
@@ -0,0 +1,88 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+
+
+class PostCursorPagination(CursorPagination):
+    # keyset pagination, newest first, on the (timestamp, id) index
+
+    ordering = ('-timestamp', '-id')
+    page_size = settings.POSTS_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.MAX_PAGE_SIZE
+
+
+class CategoryPostsCursorPagination(PostCursorPagination):
+    # pages of PostCategory rows, on post_category_timestamp_idx
+
+    ordering = ('-timestamp', '-post_id')
+
+
+class CommentCursorPagination(CursorPagination):
+    # keyset pagination, newest first, on the (post, timestamp, id) index
+
+    ordering = ('-timestamp', '-id')
+    page_size = settings.COMMENTS_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.MAX_PAGE_SIZE
+
+
+class CommentThreadCursorPagination(CursorPagination):
+    # replies in thread order, on the (post, path) index
+
+    ordering = 'path'
+    page_size = settings.COMMENTS_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.MAX_PAGE_SIZE
+
+
+class SearchPagination(LimitOffsetPagination):
+    # search results are ordered by relevance, so there is no keyset to use
+
+    default_limit = settings.POSTS_PAGE_SIZE
+    max_limit = settings.MAX_PAGE_SIZE
+
+
+class RankedPagination(LimitOffsetPagination):
+    # trending and recommended posts, ranked by a score that changes with
+    # every rollup or recompute
+
+    default_limit = settings.POSTS_PAGE_SIZE
+    max_limit = settings.MAX_PAGE_SIZE
+
+
+class ReadingListCursorPagination(CursorPagination):
+    ordering = ('-timestamp', '-id')
+    page_size = settings.PROFILE_PAGE_SIZE
+    cursor_query_param = 'reading_list_cursor'
+
+
+class MyPostsCursorPagination(CursorPagination):
+    ordering = ('-timestamp', '-id')
+    page_size = settings.PROFILE_PAGE_SIZE
+    cursor_query_param = 'my_posts_cursor'
+
+
+def paginate_section(pagination_class, queryset, request):
+    # one page of a list nested in another response, each section has its
+    # own cursor parameter so they can be paged independently
+    paginator = pagination_class()
+    if request is None:
+        page = queryset.order_by(*paginator.ordering)[:paginator.page_size]
+        return list(page), None, None
+    page = paginator.paginate_queryset(queryset, request)
+    return page, paginator.get_next_link(), paginator.get_previous_link()
+
+
+def first_page_next_link(pagination_class, page, following, base_url):
+    # the link to the second page of a list whose first page (and the item
+    # after it) was loaded some other way, see CommentPreviews
+    if following is None:
+        return None
+    paginator = pagination_class()
+    paginator.base_url = base_url
+    paginator.page = list(page)
+    paginator.page_size = len(paginator.page)
+    paginator.cursor = None
+    paginator.has_next, paginator.has_previous = True, False
+    paginator.next_position = paginator._get_position_from_instance(following, paginator.ordering)
+    return paginator.get_next_link()
@@ -1,17 +1,39 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import get_user_model
-
-from posts.models import Post, Author, Category, Comment, UserProfile, PostView
+from django.db.models import OuterRef, Q, Subquery
+from django.urls import reverse
+
+from posts.images import srcset
+from posts.metrics import request_metrics
+from posts.models import Post, Author, Category, Comment, UserProfile, PostView, RelatedPost
+from posts.rendering import load_toc
+from .pagination import (
+    CommentCursorPagination, ReadingListCursorPagination, MyPostsCursorPagination,
+    first_page_next_link, paginate_section
+)
 
 User = get_user_model()
 
 
-class PostSerializer(serializers.ModelSerializer):
+class TimedModelSerializer(serializers.ModelSerializer):
+    # reported as serializer time by posts.middleware
+
+    def to_representation(self, instance):
+        with request_metrics.serializer_timer():
+            return super().to_representation(instance)
+
+
+class PostSerializer(TimedModelSerializer):
     author = serializers.SerializerMethodField()
     category = serializers.SerializerMethodField()
+    thumbnail_srcset = serializers.SerializerMethodField()
+    toc = serializers.SerializerMethodField()
     previous_post = serializers.SerializerMethodField()
     next_post = serializers.SerializerMethodField()
+    related_posts = serializers.SerializerMethodField()
     comments = serializers.SerializerMethodField()
+    comments_next = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
@@ -22,12 +44,20 @@ class PostSerializer(serializers.ModelSerializer):
             'timestamp',
             'author',
             'thumbnail',
+            'thumbnail_srcset',
             'category',
             'featured',
             'content',
+            'content_html',
+            'excerpt',
+            'word_count',
+            'reading_time',
+            'toc',
             'previous_post',
             'next_post',
+            'related_posts',
             'comments',
+            'comments_next',
             'likes',
             'view_count',
             'comment_count'
@@ -39,17 +69,212 @@ class PostSerializer(serializers.ModelSerializer):
     def get_category(self, obj):
         return CategorySerializer(obj.category.all(), many=True).data
 
+    def get_thumbnail_srcset(self, obj):
+        return srcset(obj.thumbnail_variants, self.context.get('request', None))
+
+    def get_toc(self, obj):
+        return load_toc(obj.toc)
+
     def get_previous_post(self, obj):
-        return PostSerializer(obj.previous_post).data
+        return self.get_post_links().get(obj.previous_post_id, self.get_depth())
 
     def get_next_post(self, obj):
-        return PostSerializer(obj.next_post).data
+        return self.get_post_links().get(obj.next_post_id, self.get_depth())
+
+    def get_depth(self):
+        return self.context.get('post_link_depth', settings.POST_LINK_DEPTH)
+
+    def get_post_links(self):
+        # neighbours of every post being serialized, shared by the list
+        if getattr(self, '_post_links', None) is None:
+            if isinstance(self.parent, serializers.ListSerializer):
+                posts = self.parent.instance
+            else:
+                posts = [self.instance]
+            self._post_links = PostLinks(posts, self.get_depth())
+        return self._post_links
+
+    def get_related_posts(self, obj):
+        if getattr(self, '_related_posts', None) is None:
+            if isinstance(self.parent, serializers.ListSerializer):
+                posts = self.parent.instance
+            else:
+                posts = [self.instance]
+            self._related_posts = RelatedPosts(posts)
+        return self._related_posts.get(obj.id)
+
+    def get_comment_previews(self):
+        if getattr(self, '_comment_previews', None) is None:
+            if isinstance(self.parent, serializers.ListSerializer):
+                posts = self.parent.instance
+            else:
+                posts = [self.instance]
+            self._comment_previews = CommentPreviews(posts, self.context.get('request', None))
+        return self._comment_previews
 
     def get_comments(self, obj):
-        return CommentSerializer(obj.comments.all(), many=True).data
+        return CommentSerializer(self.get_comment_previews().get(obj.id), many=True).data
+
+    def get_comments_next(self, obj):
+        return self.get_comment_previews().next_link(obj.id)
+
+
+def get_query_list(request, name):
+    value = request.query_params.get(name, '')
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+class PostSummarySerializer(PostSerializer):
+    # feed representation, without the rich-text content, neighbours and
+    # comment thread unless asked for with ?expand= or ?fields=
+
+    expandable_fields = [
+        'content', 'content_html', 'toc', 'previous_post', 'next_post', 'related_posts',
+        'comments', 'comments_next']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request', None)
+        requested = self.requested_fields(request)
+        for field_name in set(self.fields) - set(requested):
+            self.fields.pop(field_name)
+
+    @classmethod
+    def requested_fields(cls, request):
+        fields = [field for field in cls.Meta.fields
+                  if field not in cls.expandable_fields]
+        if request is None:
+            return fields
+
+        expand = get_query_list(request, 'expand')
+        if 'comments' in expand:
+            expand.append('comments_next')
+        fields += [field for field in cls.expandable_fields if field in expand]
+
+        only = get_query_list(request, 'fields')
+        if only:
+            fields = [field for field in cls.Meta.fields if field in only]
+        return fields
+
+
+class PostLinkSerializer(TimedModelSerializer):
+    # compact representation of a previous/next post
+
+    class Meta:
+        model = Post
+        fields = [
+            'id',
+            'title',
+            'thumbnail',
+            'timestamp'
+        ]
 
 
-class UserSerializer(serializers.ModelSerializer):
+class PostLinks:
+    # Loads the previous/next neighbours of a group of posts, one query per
+    # level of depth, so serializing a post never walks the whole chain.
+
+    fields = ['id', 'title', 'thumbnail', 'timestamp',
+              'previous_post_id', 'next_post_id']
+
+    def __init__(self, posts, depth):
+        self.posts = {}
+
+        neighbour_ids = self.neighbour_ids(posts)
+        for _ in range(depth):
+            neighbour_ids -= self.posts.keys()
+            if not neighbour_ids:
+                break
+            neighbours = Post.objects.filter(
+                id__in=neighbour_ids).only(*self.fields)
+            self.posts.update((post.id, post) for post in neighbours)
+            neighbour_ids = self.neighbour_ids(neighbours)
+
+    @staticmethod
+    def neighbour_ids(posts):
+        ids = set()
+        for post in posts:
+            ids.add(post.previous_post_id)
+            ids.add(post.next_post_id)
+        ids.discard(None)
+        return ids
+
+    def get(self, post_id, depth):
+        post = self.posts.get(post_id) if depth > 0 else None
+        data = self.link_data(post)
+        if post is not None and depth > 1:
+            data['previous_post'] = self.get(post.previous_post_id, depth - 1)
+            data['next_post'] = self.get(post.next_post_id, depth - 1)
+        return data
+
+    def link_data(self, post):
+        return PostLinkSerializer(post).data
+
+
+class RelatedPosts:
+    # The precomputed related posts of a group of posts, best first, in
+    # one query on the (post, rank) index.
+
+    def __init__(self, posts):
+        self.posts = {}
+        rows = RelatedPost.objects.filter(
+            post__in=[post.id for post in posts]
+        ).select_related('related').only(
+            'post', 'related', *['related__' + field for field in PostLinkSerializer.Meta.fields]
+        ).order_by('post', 'rank')
+        for row in rows:
+            self.posts.setdefault(row.post_id, []).append(row.related)
+
+    def get(self, post_id):
+        return [self.link_data(post) for post in self.posts.get(post_id, [])]
+
+    def link_data(self, post):
+        return PostLinkSerializer(post).data
+
+
+class CommentPreviews:
+    # The first page of top-level comments of a group of posts, newest
+    # first as on the comments endpoint, and the link to the next page.
+    # Two queries however many posts: the comment right after the page of
+    # each post, then every comment up to it.
+
+    def __init__(self, posts, request=None):
+        self.request = request
+        self.page_size = CommentCursorPagination.page_size
+        threads = Comment.objects.filter(parent__isnull=True)
+        following = threads.filter(post=OuterRef('pk')).order_by('-timestamp', '-id')
+        cutoffs = Post.objects.filter(id__in=[post.id for post in posts]).annotate(
+            following_id=Subquery(following.values('id')[self.page_size:self.page_size + 1]),
+            following_timestamp=Subquery(
+                following.values('timestamp')[self.page_size:self.page_size + 1]),
+        ).values_list('id', 'following_id', 'following_timestamp')
+
+        selected = Q(post__in=[])
+        for post_id, following_id, timestamp in cutoffs:
+            if following_id is None:
+                selected |= Q(post=post_id)
+            else:
+                selected |= Q(post=post_id) & (
+                    Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gte=following_id))
+        self.comments = {}
+        for comment in threads.filter(selected).select_related('user').order_by(
+                'post', '-timestamp', '-id'):
+            self.comments.setdefault(comment.post_id, []).append(comment)
+
+    def get(self, post_id):
+        return self.comments.get(post_id, [])[:self.page_size]
+
+    def next_link(self, post_id):
+        comments = self.comments.get(post_id, [])
+        url = reverse('create-comment', kwargs={'pk': post_id})
+        if self.request is not None:
+            url = self.request.build_absolute_uri(url)
+        return first_page_next_link(
+            CommentCursorPagination, comments[:self.page_size],
+            comments[self.page_size] if len(comments) > self.page_size else None, url)
+
+
+class UserSerializer(TimedModelSerializer):
     class Meta:
         model = User
         fields = [
@@ -58,22 +283,27 @@ class UserSerializer(serializers.ModelSerializer):
         ]
 
 
-class AuthorSerializer(serializers.ModelSerializer):
+class AuthorSerializer(TimedModelSerializer):
     user = serializers.SerializerMethodField()
+    profile_image_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Author
         fields = [
             'id',
             'user',
-            'profile_image'
+            'profile_image',
+            'profile_image_srcset'
         ]
 
     def get_user(self, obj):
         return UserSerializer(obj.user).data
 
+    def get_profile_image_srcset(self, obj):
+        return srcset(obj.profile_image_variants)
+
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TimedModelSerializer):
     class Meta:
         model = Category
         fields = [
@@ -82,7 +312,18 @@ class CategorySerializer(serializers.ModelSerializer):
         ]
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CategoryIndexSerializer(TimedModelSerializer):
+    class Meta:
+        model = Category
+        fields = [
+            'id',
+            'title',
+            'post_count',
+            'latest_post_at'
+        ]
+
+
+class CommentSerializer(TimedModelSerializer):
     user = serializers.SerializerMethodField()
     # post = serializers.SerializerMethodField()
 
@@ -92,14 +333,17 @@ class CommentSerializer(serializers.ModelSerializer):
             'id',
             'user',
             'timestamp',
-            'content'
+            'content',
+            'parent',
+            'depth',
+            'reply_count'
         ]
 
     def get_user(self, obj):
         return UserSerializer(obj.user).data
 
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(TimedModelSerializer):
     user = serializers.SerializerMethodField()
     reading_list = serializers.SerializerMethodField()
     my_posts = serializers.SerializerMethodField()
@@ -116,22 +360,39 @@ class UserProfileSerializer(serializers.ModelSerializer):
     def get_user(self, obj):
         return UserSerializer(obj.user).data
 
+    def get_section(self, pagination_class, queryset, serializer_class):
+        page, next_link, previous_link = paginate_section(
+            pagination_class, queryset, self.context.get('request', None))
+        return {
+            'next': next_link,
+            'previous': previous_link,
+            'results': serializer_class(page, many=True).data
+        }
+
     def get_reading_list(self, obj):
-        return PostViewSerializer(obj.reading_list.all(), many=True).data
+        return self.get_section(
+            ReadingListCursorPagination,
+            obj.reading_list.select_related('post').only(
+                'id', 'timestamp', 'post__id', 'post__title', 'post__thumbnail', 'post__timestamp'),
+            PostViewSerializer)
 
     def get_my_posts(self, obj):
-        return PostSerializer(obj.my_posts.all(), many=True).data
+        return self.get_section(
+            MyPostsCursorPagination,
+            obj.my_posts.only('id', 'title', 'thumbnail', 'timestamp'),
+            PostLinkSerializer)
 
 
-class PostViewSerializer(serializers.ModelSerializer):
+class PostViewSerializer(TimedModelSerializer):
     post = serializers.SerializerMethodField()
 
     class Meta:
         model = PostView
         fields = [
             'id',
+            'timestamp',
             'post'
         ]
 
     def get_post(self, obj):
-        return PostSerializer(obj.post).data
+        return PostLinkSerializer(obj.post).data
@@ -1,14 +1,24 @@
 from django.urls import path
 
 from .views import (
-    PostsView, PostDetailView, CommentView, CategoryView, UserIdView, UserProfileView
+    PostsView, PostDetailView, CommentView, CategoryView, UserIdView, UserProfileView, LikeView,
+    LikedPostsView, PostSearchView, CommentRepliesView, CategoryPostsView, MetricsView,
+    TrendingPostsView, RecommendedPostsView
 )
 
 urlpatterns = [
     path('posts/', PostsView.as_view(), name='posts'),
+    path('posts/liked/', LikedPostsView.as_view(), name='liked-posts'),
+    path('posts/search/', PostSearchView.as_view(), name='search-posts'),
+    path('posts/trending/', TrendingPostsView.as_view(), name='trending-posts'),
     path('posts/<pk>/', PostDetailView.as_view(), name='post-detail'),
     path('posts/<pk>/comments/', CommentView.as_view(), name='create-comment'),
+    path('posts/<int:pk>/like/', LikeView.as_view(), name='like-post'),
+    path('comments/<int:pk>/replies/', CommentRepliesView.as_view(), name='comment-replies'),
     path('categories/', CategoryView.as_view(), name='get-categories'),
+    path('categories/<int:pk>/posts/', CategoryPostsView.as_view(), name='category-posts'),
     path('users/id/', UserIdView.as_view(), name='get-user-id'),
+    path('users/recommended/', RecommendedPostsView.as_view(), name='recommended-posts'),
     path('users/<pk>/profile/', UserProfileView.as_view(), name='user-profile'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
@@ -2,21 +2,44 @@ from rest_framework.views import APIView
 from rest_framework.generics import (
     ListAPIView, RetrieveAPIView, ListCreateAPIView, RetrieveUpdateDestroyAPIView
 )
-from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 from rest_framework.status import (
     HTTP_200_OK, HTTP_201_CREATED, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_401_UNAUTHORIZED
 )
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError, transaction
+from django.db.models import F
 from django.http import Http404, JsonResponse
 
-from posts.models import Post, PostView, Comment, Author, Category, UserProfile, Like
+from posts.buffers import engagement_events, post_view_buffer
+from posts.cache import (
+    CachedResponseMixin, CATEGORY_VERSION, CATEGORY_INDEX_VERSION, LIST_VERSION, RELATED_VERSION,
+    TRENDING_VERSION, post_version, response_cache
+)
+from posts.engagement import WINDOWS, trending_scores
+from posts.metrics import request_metrics
+from posts.models import (
+    Post, PostCategory, Comment, Author, Category, UserProfile, Like, EngagementEvent
+)
+from posts.recommendations import recommended_posts
+from posts.rendering import LONG_FIELDS
+from posts.search import search_posts
+from posts.utils import jwt_decode_token, token_cache
+from .fast import (
+    FastReadMixin, FastPostSerializer, FastPostSummarySerializer, FastCategoryIndexSerializer,
+    FastCommentSerializer, FastUserProfileSerializer
+)
+from .pagination import (
+    PostCursorPagination, CategoryPostsCursorPagination, CommentCursorPagination,
+    CommentThreadCursorPagination, SearchPagination, RankedPagination
+)
 from .serializers import (
-    PostSerializer, CategorySerializer, PostViewSerializer, UserProfileSerializer
+    PostSerializer, PostSummarySerializer, CategoryIndexSerializer, CommentSerializer,
+    UserProfileSerializer, get_query_list
 )
 
 from functools import wraps
-import jwt
 
 
 def get_token_auth_header(request):
@@ -36,7 +59,12 @@ def requires_scope(required_scope):
         @wraps(f)
         def decorated(*args, **kwargs):
             token = get_token_auth_header(args[0])
-            decoded = jwt.decode(token, verify=False)
+            # already verified by the authentication class, so this is
+            # normally a hit in posts.utils.token_cache
+            try:
+                decoded = jwt_decode_token(token)
+            except Exception:
+                decoded = {}
             if decoded.get("scope"):
                 token_scopes = decoded["scope"].split()
                 for token_scope in token_scopes:
@@ -50,46 +78,153 @@ def requires_scope(required_scope):
     return require_scope
 
 
+def get_selected_categories(titles):
+    # all selected categories in one query, None if any of them is unknown
+    categories = list(Category.objects.filter(title__in=set(titles)))
+    if len(categories) != len(set(titles)):
+        return None
+    return categories
+
+
 class UserIdView(APIView):
     def get(self, request, *args, **kwargs):
         return Response({'user_id': request.user.id}, status=HTTP_200_OK)
 
 
-class UserProfileView(RetrieveAPIView):
+class UserProfileView(FastReadMixin, RetrieveAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = UserProfileSerializer
+    fast_serializer_class = FastUserProfileSerializer
 
     def get_queryset(self):
-        return UserProfile.objects.filter(user=self.request.user)
+        return UserProfile.objects.filter(user=self.request.user).select_related('user')
 
 
-class CategoryView(ListAPIView):
+class CategoryView(CachedResponseMixin, FastReadMixin, ListAPIView):
     permission_classes = [IsAuthenticated]
-    serializer_class = CategorySerializer
-    queryset = Category.objects.all()
+    serializer_class = CategoryIndexSerializer
+    fast_serializer_class = FastCategoryIndexSerializer
+    cache_scope = 'categories'
+    orderings = {
+        'title': ('title',),
+        'posts': ('-post_count', 'title'),
+        'latest': (F('latest_post_at').desc(nulls_last=True), 'title'),
+    }
+
+    def get_cache_versions(self):
+        return [CATEGORY_VERSION, CATEGORY_INDEX_VERSION]
+
+    def get_queryset(self):
+        queryset = Category.objects.all()
+        ordering = self.request.query_params.get('ordering', None)
+        if ordering is not None:
+            if ordering not in self.orderings:
+                raise Http404('Unknown ordering.')
+            queryset = queryset.order_by(*self.orderings[ordering])
+        return queryset
+
+
+class CategoryPostsView(CachedResponseMixin, FastReadMixin, ListAPIView):
+    permission_classes = [IsAuthenticatedOrReadOnly]
+    serializer_class = PostSummarySerializer
+    fast_serializer_class = FastPostSummarySerializer
+    pagination_class = CategoryPostsCursorPagination
+    cache_scope = 'category-posts'
+
+    def get_cache_versions(self):
+        return [LIST_VERSION, CATEGORY_VERSION]
+
+    def get_queryset(self):
+        # the category's rows of the Post.category table, newest first
+        if not Category.objects.filter(id=self.kwargs.get('pk')).exists():
+            raise Http404('This category does not exist.')
+        return PostCategory.objects.filter(category_id=self.kwargs.get('pk')).only(
+            'post_id', 'timestamp')
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        fields = PostSummarySerializer.requested_fields(request)
+        posts = Post.objects.for_api(content=bool(LONG_FIELDS & set(fields))).in_bulk(
+            [row.post_id for row in page])
+        serializer = self.get_serializer([posts[row.post_id] for row in page], many=True)
+        return self.get_paginated_response(serializer.data)
 
 
 class LikeView(APIView):
+    # like or unlike a post, answers with the updated like count
+
     def post(self, request, *args, **kwargs):
-        if request.user.is_authenticated:
-            current_post_id = request.data.get('blogId', None)
-            if current_post_id is None:
-                return Response({'message': 'This blog does not exist.'}, status=HTTP_404_NOT_FOUND)
+        # toggles the like
+        post_id = self.get_post_id(request)
+        with transaction.atomic():
+            if self.remove_like(request.user, post_id):
+                liked = False
+            else:
+                self.add_like(request.user, post_id)
+                liked = True
+        return self.like_response(post_id, liked)
+
+    def delete(self, request, *args, **kwargs):
+        post_id = self.get_post_id(request)
+        with transaction.atomic():
+            self.remove_like(request.user, post_id)
+        return self.like_response(post_id, False)
+
+    def get_post_id(self, request):
+        post_id = self.kwargs.get('pk', None) or request.data.get('blogId', None)
+        if post_id is None or not Post.objects.filter(id=post_id).exists():
+            raise Http404('This blog does not exist.')
+        return post_id
 
-            try:
-                current_post = Post.objects.get(id=current_post_id)
-            except ObjectDoesNotExist:
-                raise Http404('This blog does not exist.')
+    def add_like(self, user, post_id):
+        try:
+            with transaction.atomic():
+                Like.objects.create(user=user, post_id=post_id)
+        except IntegrityError:
+            # a concurrent request liked it first
+            return
+        Post.objects.filter(id=post_id).adjust_count('likes_count', 1)
 
-            like = Like.objects.filter(user=request.user, post=current_post)
-            if like.exists():
-                like.delete()
-            else:
-                Like.objects.create(user=request.user, post=current_post)
-            return Response({'message': 'Successfully submitted a like.'}, status=HTTP_201_CREATED)
+    def remove_like(self, user, post_id):
+        deleted, _ = Like.objects.filter(user=user, post_id=post_id).delete()
+        if deleted:
+            Post.objects.filter(id=post_id).adjust_count('likes_count', -deleted)
+        return deleted
+
+    def like_response(self, post_id, liked):
+        likes = Post.objects.filter(id=post_id).values_list(
+            'likes_count', flat=True).get()
+        return Response({'message': 'Successfully submitted a like.', 'liked': liked, 'likes': likes},
+                        status=HTTP_201_CREATED)
 
 
-class CommentView(APIView):
+class LikedPostsView(APIView):
+    # which of the given posts (?ids=1,2,3) the user has liked, one query
+
+    def get(self, request, *args, **kwargs):
+        try:
+            post_ids = [int(post_id) for post_id in get_query_list(request, 'ids')]
+        except ValueError:
+            return Response({'message': 'Invalid data received.'}, status=HTTP_400_BAD_REQUEST)
+
+        liked = Like.objects.filter(
+            user=request.user, post_id__in=post_ids).values_list('post_id', flat=True)
+        return Response({'liked': sorted(liked)}, status=HTTP_200_OK)
+
+
+class CommentView(FastReadMixin, ListAPIView):
+    # get comments, create comment
+
+    permission_classes = [IsAuthenticatedOrReadOnly]
+    serializer_class = CommentSerializer
+    fast_serializer_class = FastCommentSerializer
+    pagination_class = CommentCursorPagination
+
+    def get_queryset(self):
+        # top-level comments, each with its reply_count
+        return Comment.objects.filter(
+            post_id=self.kwargs.get('pk'), parent__isnull=True).select_related('user')
+
     def post(self, request, *args, **kwargs):
         comment = request.data.get('comment', None)
         post_id = request.data.get('blogId', None)
@@ -105,29 +240,76 @@ class CommentView(APIView):
         except ObjectDoesNotExist:
             raise Http404('This blog does not exist.')
 
+        parent = None
+        parent_id = request.data.get('parentId', None)
+        if parent_id is not None:
+            try:
+                parent = Comment.objects.get(id=parent_id, post=post)
+            except ObjectDoesNotExist:
+                raise Http404('This comment does not exist.')
+
         if request.user.is_authenticated:
             new_comment = Comment(
                 user=request.user,
                 content=comment,
-                post=post
+                post=post,
+                parent=parent
             )
-            new_comment.save()
-
-            post.comments.add(new_comment)
-            post.save()
+            with transaction.atomic():
+                new_comment.save()
+                Post.objects.filter(id=post.id).adjust_count(
+                    'comments_count', 1)
 
-            return Response({'message': 'Successfully submitted a comment.'}, status=HTTP_201_CREATED)
+            return Response({'message': 'Successfully submitted a comment.', 'id': new_comment.id},
+                            status=HTTP_201_CREATED)
 
         else:
             return Response({'message': 'You must login first.'}, status=HTTP_401_UNAUTHORIZED)
 
 
-class PostsView(ListCreateAPIView):
+class CommentRepliesView(FastReadMixin, ListAPIView):
+    # get every reply below a comment, in thread order
+
+    permission_classes = [IsAuthenticatedOrReadOnly]
+    serializer_class = CommentSerializer
+    fast_serializer_class = FastCommentSerializer
+    pagination_class = CommentThreadCursorPagination
+
+    def get_queryset(self):
+        try:
+            comment = Comment.objects.only('id', 'post_id', 'path').get(id=self.kwargs.get('pk'))
+        except ObjectDoesNotExist:
+            raise Http404('This comment does not exist.')
+
+        # descendants sort between "<path>" and "<path minus its '/'>0"
+        return Comment.objects.filter(
+            post_id=comment.post_id, path__gt=comment.path, path__lt=comment.path[:-1] + '0'
+        ).select_related('user')
+
+
+class PostsView(CachedResponseMixin, FastReadMixin, ListCreateAPIView):
     # get posts, create post
 
     permission_classes = [IsAuthenticatedOrReadOnly]
-    serializer_class = PostSerializer
-    queryset = Post.objects.all()
+    serializer_class = PostSummarySerializer
+    fast_serializer_class = FastPostSummarySerializer
+    pagination_class = PostCursorPagination
+    cache_scope = 'posts'
+
+    def get_queryset(self):
+        fields = PostSummarySerializer.requested_fields(self.request)
+        queryset = Post.objects.for_api(content=bool(LONG_FIELDS & set(fields)))
+
+        featured = self.request.query_params.get('featured', None)
+        if featured is not None:
+            queryset = queryset.filter(
+                featured=featured.lower() in ('1', 'true'))
+
+        category = self.request.query_params.get('category', None)
+        if category is not None:
+            queryset = queryset.filter(category__title=category)
+
+        return queryset
 
     def post(self, request, *args, **kwargs):
         form = request.data.get('formData', None)
@@ -142,6 +324,10 @@ class PostsView(ListCreateAPIView):
             current_author, created = Author.objects.get_or_create(
                 user=request.user)
 
+            categories = get_selected_categories(selected_categories)
+            if categories is None:
+                return Response({'message': 'This category does not exist.'}, status=HTTP_404_NOT_FOUND)
+
             created_post = Post(
                 title=form['title'],
                 overview=form['overview'],
@@ -149,12 +335,9 @@ class PostsView(ListCreateAPIView):
                 thumbnail=form['thumbnail'],
                 content=form['content']
             )
-            created_post.save()
-
-            for category in selected_categories:
-                selected_category = Category.objects.get(title=category)
-                created_post.category.add(selected_category)
-            created_post.save()
+            with transaction.atomic():
+                created_post.save()
+                created_post.category.add(*categories)
 
             return Response({'message': 'Successfully created a new post.', 'id': created_post.id}, status=HTTP_201_CREATED)
 
@@ -162,23 +345,110 @@ class PostsView(ListCreateAPIView):
             return Response({'message': 'You must login first.'}, status=HTTP_401_UNAUTHORIZED)
 
 
-class PostDetailView(RetrieveUpdateDestroyAPIView):
+class PostSearchView(FastReadMixin, ListAPIView):
+    # search posts by title, overview and content, best match first
+
+    permission_classes = [IsAuthenticatedOrReadOnly]
+    serializer_class = PostSummarySerializer
+    fast_serializer_class = FastPostSummarySerializer
+    pagination_class = SearchPagination
+
+    def get_queryset(self):
+        fields = PostSummarySerializer.requested_fields(self.request)
+        queryset = Post.objects.for_api(content=bool(LONG_FIELDS & set(fields)))
+
+        category = self.request.query_params.get('category', None)
+        if category is not None:
+            queryset = queryset.filter(category__title=category)
+
+        author = self.request.query_params.get('author', None)
+        if author is not None:
+            queryset = queryset.filter(author__user__username=author)
+
+        return search_posts(queryset, self.request.query_params.get('q', ''))
+
+
+class RankedPostsMixin:
+    # lists the posts of a queryset of {ranked_key: post id, 'score'} rows,
+    # best first, with their scores
+
+    serializer_class = PostSummarySerializer
+    fast_serializer_class = FastPostSummarySerializer
+    pagination_class = RankedPagination
+    ranked_key = 'post'
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        fields = PostSummarySerializer.requested_fields(request)
+        posts = Post.objects.for_api(content=bool(LONG_FIELDS & set(fields))).in_bulk(
+            [row[self.ranked_key] for row in page])
+        page = [row for row in page if row[self.ranked_key] in posts]
+        data = self.get_serializer([posts[row[self.ranked_key]] for row in page], many=True).data
+        for item, row in zip(data, page):
+            item['score'] = round(row['score'], 3)
+        return self.get_paginated_response(data)
+
+
+class TrendingPostsView(RankedPostsMixin, CachedResponseMixin, FastReadMixin, ListAPIView):
+    # posts ranked by time-decayed engagement, read from the rollups only
+    # (?window=day|week|month)
+
+    permission_classes = [IsAuthenticatedOrReadOnly]
+    cache_scope = 'trending-posts'
+
+    def get_cache_versions(self):
+        return [LIST_VERSION, TRENDING_VERSION]
+
+    def get_queryset(self):
+        window = self.request.query_params.get('window', 'day')
+        if window not in WINDOWS:
+            raise Http404('Unknown window.')
+        return trending_scores(window)
+
+
+class RecommendedPostsView(RankedPostsMixin, FastReadMixin, ListAPIView):
+    # what to read next, from the related posts of the user's latest views
+
+    permission_classes = [IsAuthenticated]
+    ranked_key = 'related'
+
+    def get_queryset(self):
+        return recommended_posts(self.request.user)
+
+
+class PostDetailView(CachedResponseMixin, FastReadMixin, RetrieveUpdateDestroyAPIView):
     # get post detail, update post, delete post
 
     permission_classes = [IsAuthenticatedOrReadOnly]
     serializer_class = PostSerializer
+    fast_serializer_class = FastPostSerializer
+    cache_scope = 'post-detail'
+
+    def get_cache_versions(self):
+        return [post_version(self.kwargs.get('pk')), CATEGORY_VERSION, RELATED_VERSION]
+
+    def cache_hit(self, request, *args, **kwargs):
+        self.record_view(request, self.kwargs.get('pk'))
+
+    def retrieve(self, request, *args, **kwargs):
+        # only reads count as views, delete() also goes through get_object()
+        post = self.get_object()
+        self.record_view(request, post.id)
+        return Response(self.get_serializer(post).data)
 
     def get_object(self):
         try:
-            post = Post.objects.get(id=self.kwargs.get('pk'))
-            if self.request.user.is_authenticated:
-                PostView.objects.get_or_create(
-                    user=self.request.user, post=post)
-            return post
+            return Post.objects.for_api().get(id=self.kwargs.get('pk'))
 
         except ObjectDoesNotExist:
             raise Http404('This post does not exist.')
 
+    def record_view(self, request, post_id):
+        # anonymous views count towards trending, not the reading list
+        engagement_events.record(EngagementEvent.VIEW, post_id, request.user.id)
+        if request.user.is_authenticated:
+            post_view_buffer.record(request.user.id, post_id)
+
     def put(self, request, *args, **kwargs):
         form = request.data.get('formData', None)
         if form is None:
@@ -193,20 +463,41 @@ class PostDetailView(RetrieveUpdateDestroyAPIView):
             return Response({'message': 'You must select at least one category.'}, status=HTTP_404_NOT_FOUND)
 
         if request.user.is_authenticated:
-            updated_post = Post.objects.get(id=updated_post_id)
+            categories = get_selected_categories(selected_categories)
+            if categories is None:
+                return Response({'message': 'This category does not exist.'}, status=HTTP_404_NOT_FOUND)
+
+            try:
+                updated_post = Post.objects.get(id=updated_post_id)
+            except ObjectDoesNotExist:
+                raise Http404('This post does not exist.')
+
             updated_post.title = form['title']
             updated_post.overview = form['overview']
             updated_post.content = form['content']
-            updated_post.save()
-
-            # update categories
-            selected_categories_list = []
-            for category in selected_categories:
-                selected_categories_list.append(
-                    Category.objects.get(title=category))
-            updated_post.category.set(selected_categories_list)
+            with transaction.atomic():
+                updated_post.save(
+                    update_fields=['title', 'overview', 'content'])
+                updated_post.category.set(categories)
 
             return Response({'message': 'Successfully updated your new post.', 'id': updated_post.id}, status=HTTP_201_CREATED)
 
         else:
             return Response({'message': 'You must login first.'}, status=HTTP_401_UNAUTHORIZED)
+
+
+class MetricsView(APIView):
+    # request latency percentiles and cache hit ratios, for staff only
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response({
+            'requests': request_metrics.stats(),
+            'response_cache': response_cache.stats(),
+            'token_cache': token_cache.stats(),
+        }, status=HTTP_200_OK)
+
+    def delete(self, request, *args, **kwargs):
+        request_metrics.clear()
+        response_cache.clear_stats()
+        return Response({'message': 'Metrics cleared.'}, status=HTTP_200_OK)
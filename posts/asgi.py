@@ -0,0 +1,148 @@
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from io import BytesIO
+import asyncio
+import jwt
+import re
+
+from .utils import jwks_store
+
+# ASGI read path for the post list/detail/trending, category, profile and
+# recommendation endpoints.
+# Django 2.2 has no async views, so these requests still go through the
+# usual middleware and DRF views, but on a bounded pool of
+# ASYNC_READ_WORKERS threads instead of one thread per connection, and a
+# missing JWKS signing key is fetched once on its own thread before the
+# request is queued, so no worker ever sits waiting on Auth0. Every other
+# request goes through asgiref's WSGI adapter as before.
+
+READ_METHODS = {'GET', 'HEAD'}
+READ_PATHS = [
+    re.compile(r'^/api/posts/$'),
+    re.compile(r'^/api/posts/trending/$'),
+    re.compile(r'^/api/posts/\d+/$'),
+    re.compile(r'^/api/categories/$'),
+    re.compile(r'^/api/categories/\d+/posts/$'),
+    re.compile(r'^/api/users/\d+/profile/$'),
+    re.compile(r'^/api/users/recommended/$'),
+]
+
+_read_executor = None
+_jwks_executor = None
+
+
+def get_read_executor():
+    global _read_executor
+    if _read_executor is None:
+        _read_executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'ASYNC_READ_WORKERS', 8),
+            thread_name_prefix='read-path')
+    return _read_executor
+
+
+def get_jwks_executor():
+    global _jwks_executor
+    if _jwks_executor is None:
+        _jwks_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='jwks')
+    return _jwks_executor
+
+
+def is_read_request(scope):
+    return (scope['method'] in READ_METHODS and
+            any(pattern.match(scope['path']) for pattern in READ_PATHS))
+
+
+def get_token_kid(scope):
+    prefix = '{} '.format(settings.JWT_AUTH['JWT_AUTH_HEADER_PREFIX']).encode('latin1')
+    for name, value in scope.get('headers', []):
+        if name.lower() == b'authorization' and value.startswith(prefix):
+            try:
+                return jwt.get_unverified_header(value[len(prefix):].strip()).get('kid')
+            except jwt.InvalidTokenError:
+                # the view rejects it
+                return None
+    return None
+
+
+def run_wsgi(wsgi_application, environ):
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [
+            (name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+
+    result = wsgi_application(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        # sends request_finished, which closes the thread's connection
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], body
+
+
+class ReadPathApplication:
+    def __init__(self, wsgi_application):
+        self.wsgi_application = wsgi_application
+        self.fallback = WsgiToAsgi(wsgi_application)
+        self._key_fetch = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http' and is_read_request(scope):
+            await self.read(scope, receive, send)
+        else:
+            await self.fallback(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read(self, scope, receive, send):
+        body = BytesIO()
+        while True:
+            message = await receive()
+            body.write(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        body.seek(0)
+
+        kid = get_token_kid(scope)
+        if kid is not None:
+            await self.fetch_key(kid)
+
+        adapter = WsgiToAsgiInstance(self.wsgi_application)
+        adapter.scope = scope
+        environ = adapter.build_environ(scope, body)
+        loop = asyncio.get_event_loop()
+        status, headers, content = await loop.run_in_executor(
+            get_read_executor(), run_wsgi, self.wsgi_application, environ)
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body',
+                    'body': b'' if scope['method'] == 'HEAD' else content})
+
+    async def fetch_key(self, kid):
+        # one fetch at a time, shared by every request waiting on a key
+        if self._key_fetch is None and not jwks_store.has_cached_key(kid):
+            loop = asyncio.get_event_loop()
+            self._key_fetch = loop.run_in_executor(
+                get_jwks_executor(), jwks_store.get_key, kid)
+            self._key_fetch.add_done_callback(self._key_fetched)
+        if self._key_fetch is not None:
+            try:
+                await asyncio.shield(self._key_fetch)
+            except Exception:
+                # the view retries and reports the failure
+                pass
+
+    def _key_fetched(self, future):
+        self._key_fetch = None
@@ -0,0 +1,193 @@
+from collections import Counter
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+import atexit
+import logging
+import threading
+
+from .cache import response_cache, post_version, LIST_VERSION
+
+logger = logging.getLogger(__name__)
+
+
+def chunked(items, size=500):
+    # keeps IN lists under the database's parameter limit
+    items = list(items)
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def existing_ids(model, ids):
+    found = set()
+    for chunk in chunked(ids):
+        found.update(model.objects.filter(id__in=chunk).values_list('id', flat=True))
+    return found
+
+
+class BatchBuffer:
+    # Collects events in memory and writes them in batches from a
+    # background thread, so a request never waits on the INSERT. The
+    # <setting_prefix>_FLUSH_SIZE and _FLUSH_INTERVAL settings control the
+    # batches, with <setting_prefix>_SYNC the events are written
+    # immediately, which is what the tests use.
+
+    setting_prefix = None
+    thread_name = None
+    pending_class = list
+
+    def __init__(self):
+        self._pending = self.pending_class()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def _setting(self, name, default):
+        return getattr(settings, '{}_{}'.format(self.setting_prefix, name), default)
+
+    def add(self, event):
+        if self._setting('SYNC', False):
+            self.write(self.pending_class([event]))
+            return
+
+        with self._lock:
+            self._append(event)
+            pending = len(self._pending)
+            if self._thread is None:
+                self._start()
+        if pending >= self._setting('FLUSH_SIZE', 100):
+            self._wakeup.set()
+
+    def _append(self, event):
+        self._pending.append(event)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, self.pending_class()
+        if pending:
+            self.write(pending)
+
+    def write(self, events):
+        raise NotImplementedError
+
+    def _start(self):
+        self._thread = threading.Thread(
+            target=self._run, name=self.thread_name, daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self._setting('FLUSH_INTERVAL', 5))
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to write buffered %s events.', self.thread_name)
+            finally:
+                close_old_connections()
+
+
+class PostViewBuffer(BatchBuffer):
+    # (user, post) view events, repeated views collapse into one
+
+    setting_prefix = 'POST_VIEW'
+    thread_name = 'post-view-buffer'
+    pending_class = set
+
+    def _append(self, event):
+        self._pending.add(event)
+
+    def record(self, user_id, post_id):
+        self.add((user_id, int(post_id)))
+
+    @staticmethod
+    def write(views):
+        from django.contrib.auth import get_user_model
+        from posts.models import Post, PostView
+
+        # the post or user may have been deleted since
+        post_ids = existing_ids(Post, {post_id for user_id, post_id in views})
+        user_ids = existing_ids(get_user_model(), {user_id for user_id, post_id in views})
+        viewers = {}
+        for user_id, post_id in views:
+            if user_id in user_ids and post_id in post_ids:
+                viewers.setdefault(post_id, []).append(user_id)
+        if not viewers:
+            return
+
+        now = timezone.now()
+        created = []
+        for post_id, user_ids in viewers.items():
+            for chunk in chunked(user_ids):
+                seen = list(PostView.objects.filter(
+                    post_id=post_id, user_id__in=chunk).values_list('user_id', flat=True))
+                # views that already existed move to the top of the reading list
+                if seen:
+                    PostView.objects.filter(post_id=post_id, user_id__in=seen).update(timestamp=now)
+                seen = set(seen)
+                created += [PostView(user_id=user_id, post_id=post_id, timestamp=now)
+                            for user_id in chunk if user_id not in seen]
+
+        # only new views change the counts and the cached responses
+        new_views = Counter(view.post_id for view in insert_views(created))
+        posts_by_delta = {}
+        for post_id, delta in new_views.items():
+            posts_by_delta.setdefault(delta, []).append(post_id)
+        for delta, post_ids in posts_by_delta.items():
+            for chunk in chunked(post_ids):
+                Post.objects.filter(id__in=chunk).adjust_count('views_count', delta)
+        if new_views:
+            response_cache.bump(
+                LIST_VERSION, *[post_version(post_id) for post_id in new_views])
+
+
+def insert_views(views):
+    # the views that were inserted: another process may have written some
+    # of them meanwhile, those are retried one by one and skipped
+    from posts.models import PostView
+
+    try:
+        with transaction.atomic():
+            PostView.objects.bulk_create(views, batch_size=500)
+        return views
+    except IntegrityError:
+        inserted = []
+        for view in views:
+            try:
+                with transaction.atomic():
+                    inserted.append(PostView.objects.create(
+                        user_id=view.user_id, post_id=view.post_id, timestamp=view.timestamp))
+            except IntegrityError:
+                pass
+        return inserted
+
+
+post_view_buffer = PostViewBuffer()
+
+
+class EngagementEventBuffer(BatchBuffer):
+    # (kind, post, user, timestamp) rows of the engagement log, every one
+    # is kept, see posts/engagement.py
+
+    setting_prefix = 'ENGAGEMENT_EVENTS'
+    thread_name = 'engagement-events'
+
+    def record(self, kind, post_id, user_id=None):
+        self.add((kind, int(post_id), user_id, timezone.now()))
+
+    @staticmethod
+    def write(events):
+        from django.contrib.auth import get_user_model
+        from posts.models import EngagementEvent, Post
+
+        # the post or user may have been deleted since
+        post_ids = existing_ids(Post, {event[1] for event in events})
+        user_ids = existing_ids(get_user_model(), {event[2] for event in events if event[2]})
+        EngagementEvent.objects.bulk_create(
+            [EngagementEvent(kind=kind, post_id=post_id, timestamp=timestamp,
+                             user_id=user_id if user_id in user_ids else None)
+             for kind, post_id, user_id, timestamp in events if post_id in post_ids],
+            batch_size=500)
+
+
+engagement_events = EngagementEventBuffer()
@@ -0,0 +1,119 @@
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+from rest_framework.status import HTTP_200_OK, HTTP_304_NOT_MODIFIED
+import hashlib
+import threading
+
+# Cached responses are keyed by the request URL and the versions of the
+# data they were built from. Writes bump those versions (see
+# posts/signals.py) instead of deleting keys, so stale entries are simply
+# never read again and expire on their own.
+
+LIST_VERSION = 'posts'
+CATEGORY_VERSION = 'categories'
+# post counts and latest post of each category
+CATEGORY_INDEX_VERSION = 'category-index'
+# engagement rollups, see posts/engagement.py
+TRENDING_VERSION = 'trending'
+# precomputed related posts, see posts/recommendations.py
+RELATED_VERSION = 'related'
+
+
+def post_version(post_id):
+    return 'post:{}'.format(post_id)
+
+
+class ResponseCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+    def get_versions(self, names):
+        keys = ['version:' + name for name in names]
+        found = self.cache.get_many(keys)
+        return [found.get(key, 1) for key in keys]
+
+    def bump(self, *names):
+        for name in names:
+            key = 'version:' + name
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                # never bumped before, or evicted
+                self.cache.set(key, 2, None)
+
+    def make_key(self, scope, url, version_names):
+        versions = self.get_versions(version_names)
+        raw = '{}|{}|{}'.format(scope, url, versions)
+        return 'response:' + hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+    def record(self, scope, outcome):
+        with self._lock:
+            counts = self._stats.setdefault(
+                scope, {'hits': 0, 'misses': 0, 'not_modified': 0})
+            counts[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for scope, counts in self._stats.items():
+                served = counts['hits'] + counts['not_modified']
+                total = served + counts['misses']
+                stats[scope] = dict(
+                    counts, hit_ratio=served / total if total else 0.0)
+            return stats
+
+    def clear_stats(self):
+        with self._lock:
+            self._stats = {}
+
+
+response_cache = ResponseCache()
+
+
+class CachedResponseMixin:
+    # Serves GET from response_cache, with ETag / If-None-Match support.
+    # Views define cache_scope and get_cache_versions().
+
+    cache_scope = None
+
+    def get_cache_versions(self):
+        return [LIST_VERSION]
+
+    def cache_hit(self, request, *args, **kwargs):
+        # side effects a cached response must still have
+        pass
+
+    def get(self, request, *args, **kwargs):
+        # the scheme and host too, responses hold absolute URLs
+        key = response_cache.make_key(
+            self.cache_scope, request.build_absolute_uri(), self.get_cache_versions())
+        etag = '"{}"'.format(key.split(':', 1)[1])
+
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            response_cache.record(self.cache_scope, 'not_modified')
+            self.cache_hit(request, *args, **kwargs)
+            response = Response(status=HTTP_304_NOT_MODIFIED)
+            response['ETag'] = etag
+            return response
+
+        data = response_cache.cache.get(key)
+        if data is not None:
+            response_cache.record(self.cache_scope, 'hits')
+            self.cache_hit(request, *args, **kwargs)
+            response = Response(data)
+        else:
+            response_cache.record(self.cache_scope, 'misses')
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != HTTP_200_OK:
+                return response
+            response_cache.cache.set(
+                key, response.data, getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300))
+
+        response['ETag'] = etag
+        return response
@@ -0,0 +1,146 @@
+from collections import Counter, namedtuple
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, ExpressionWrapper, F, FloatField, Max, Min, Sum, Value, When
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .cache import response_cache, TRENDING_VERSION
+from .models import DailyEngagement, EngagementEvent, EngagementRollupState, HourlyEngagement
+
+# Engagement analytics. Views, likes, unlikes and comments are appended to
+# the EngagementEvent log in batches (posts.buffers.engagement_events).
+# roll_up() adds the events it hasn't seen yet to per-post hourly and
+# daily counts, and trending_scores() ranks posts from those counts only,
+# with every period's weighted engagement halved each half-life it is
+# older than the current one.
+
+COUNT_FIELDS = {
+    EngagementEvent.VIEW: 'views',
+    EngagementEvent.LIKE: 'likes',
+    EngagementEvent.UNLIKE: 'unlikes',
+    EngagementEvent.COMMENT: 'comments',
+}
+
+WEIGHTS = {'views': 1, 'likes': 5, 'unlikes': -5, 'comments': 3}
+
+Window = namedtuple('Window', ['model', 'period', 'periods', 'half_life'])
+
+WINDOWS = {
+    'day': Window(HourlyEngagement, timedelta(hours=1), 24, timedelta(hours=6)),
+    'week': Window(DailyEngagement, timedelta(days=1), 7, timedelta(days=2)),
+    'month': Window(DailyEngagement, timedelta(days=1), 30, timedelta(days=7)),
+}
+
+
+def period_start(moment, period):
+    start = moment.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    if period >= timedelta(days=1):
+        start = start.replace(hour=0)
+    return start
+
+
+def add_counts(model, counts):
+    # counts is {(post_id, start): Counter(field=count)}
+    starts = {start for post_id, start in counts}
+    post_ids = [post_id for post_id, start in counts]
+    existing = {
+        (rollup.post_id, rollup.start): rollup
+        for rollup in model.objects.filter(
+            start__in=starts, post__id__range=(min(post_ids), max(post_ids)))
+    }
+
+    created, updated = [], []
+    for (post_id, start), fields in counts.items():
+        rollup = existing.get((post_id, start))
+        if rollup is None:
+            created.append(model(post_id=post_id, start=start, **fields))
+            continue
+        for field, count in fields.items():
+            setattr(rollup, field, getattr(rollup, field) + count)
+        updated.append(rollup)
+    model.objects.bulk_create(created, batch_size=500)
+    model.objects.bulk_update(updated, list(COUNT_FIELDS.values()), batch_size=500)
+
+
+def roll_up_batch(state, batch_size, cutoff):
+    events = EngagementEvent.objects.filter(id__gt=state.last_event_id).order_by('id')
+    # a process may still be writing events with lower ids than the ones
+    # already visible, so the watermark stops before the first recent one
+    recent = events.filter(timestamp__gte=cutoff).aggregate(first=Min('id'))['first']
+    if recent is not None:
+        events = events.filter(id__lt=recent)
+    last = list(events.values_list('id', flat=True)[batch_size - 1:batch_size])
+    last_id = last[0] if last else events.aggregate(last=Max('id'))['last']
+    if last_id is None:
+        return 0
+
+    rows = EngagementEvent.objects.filter(
+        id__gt=state.last_event_id, id__lte=last_id
+    ).annotate(
+        hour=TruncHour('timestamp', tzinfo=timezone.utc)
+    ).values('post', 'hour', 'kind').annotate(count=Count('id')).order_by()
+
+    hourly, daily = {}, {}
+    counted = 0
+    for row in rows:
+        field = COUNT_FIELDS[row['kind']]
+        hourly.setdefault((row['post'], row['hour']), Counter())[field] += row['count']
+        daily.setdefault((row['post'], row['hour'].replace(hour=0)), Counter())[field] += row['count']
+        counted += row['count']
+    if hourly:
+        add_counts(HourlyEngagement, hourly)
+        add_counts(DailyEngagement, daily)
+
+    state.last_event_id = last_id
+    state.rolled_up_at = timezone.now()
+    state.save()
+    return counted
+
+
+def roll_up(batch_size=10000, now=None):
+    # counts the events logged since the last run that are older than
+    # ENGAGEMENT_ROLLUP_LAG seconds, returns how many
+    cutoff = (now or timezone.now()) - timedelta(
+        seconds=getattr(settings, 'ENGAGEMENT_ROLLUP_LAG', 60))
+    total = 0
+    while True:
+        # one batch per transaction, the state row keeps runs from overlapping
+        with transaction.atomic():
+            state, created = EngagementRollupState.objects.select_for_update().get_or_create(id=1)
+            counted = roll_up_batch(state, batch_size, cutoff)
+        if not counted:
+            break
+        total += counted
+    if total:
+        response_cache.bump(TRENDING_VERSION)
+    return total
+
+
+def prune(events_before=None, hourly_before=None):
+    # drops rolled-up events and hourly counts older than the given times
+    state = EngagementRollupState.objects.filter(id=1).first()
+    deleted = {'events': 0, 'hourly': 0}
+    if events_before is not None and state is not None:
+        deleted['events'], _ = EngagementEvent.objects.filter(
+            id__lte=state.last_event_id, timestamp__lt=events_before).delete()
+    if hourly_before is not None:
+        deleted['hourly'], _ = HourlyEngagement.objects.filter(start__lt=hourly_before).delete()
+    return deleted
+
+
+def trending_scores(window, now=None):
+    # post and score of every post engaged with in the window, best first
+    window = WINDOWS[window]
+    current = period_start(now or timezone.now(), window.period)
+    starts = [current - window.period * age for age in range(window.periods)]
+
+    points = sum(F(field) * weight for field, weight in WEIGHTS.items())
+    decay = Case(
+        *[When(start=start, then=Value(0.5 ** ((current - start) / window.half_life)))
+          for start in starts],
+        default=Value(0.0), output_field=FloatField())
+    return window.model.objects.filter(start__gte=starts[-1]).values('post').annotate(
+        score=Sum(ExpressionWrapper(points * decay, output_field=FloatField()))
+    ).filter(score__gt=0).order_by('-score', '-post')
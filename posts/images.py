@@ -0,0 +1,134 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image
+import hashlib
+import io
+import json
+import logging
+
+from .cache import response_cache, post_version, LIST_VERSION
+
+logger = logging.getLogger(__name__)
+
+# Resized WebP/JPEG copies of uploaded images. Variants are stored under
+# MEDIA_ROOT/derivatives/ with the hash of the original in their name, so
+# the same upload is never processed twice, and recorded on the model as
+# JSON in <field>_variants:
+#   {"source": "<original name>", "webp": {"320": "<name>", ...}, "jpeg": {...}}
+
+FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'IMAGE_VARIANT_WORKERS', 2),
+            thread_name_prefix='image-variants')
+    return _executor
+
+
+def make_variants(field_file):
+    storage = field_file.storage
+    with storage.open(field_file.name, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()[:16]
+
+    variants = {'source': field_file.name}
+    with Image.open(io.BytesIO(data)) as original:
+        original.load()
+        for key, (pil_format, extension) in FORMATS.items():
+            variants[key] = {}
+            for width in settings.IMAGE_VARIANT_WIDTHS:
+                # never upscale, the largest variant is the original size
+                width = min(width, original.width)
+                if str(width) in variants[key]:
+                    break
+                name = 'derivatives/{}-{}.{}'.format(digest, width, extension)
+                if not storage.exists(name):
+                    storage.save(name, ContentFile(resize(original, width, pil_format)))
+                variants[key][str(width)] = name
+    return variants
+
+
+def resize(original, width, pil_format):
+    image = original.copy()
+    image.thumbnail((width, width * 10), Image.LANCZOS)
+    if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    output = io.BytesIO()
+    image.save(output, pil_format, quality=82)
+    return output.getvalue()
+
+
+def needs_variants(instance, field_name):
+    field_file = getattr(instance, field_name)
+    if not field_file:
+        return False
+    variants = load_variants(getattr(instance, field_name + '_variants'))
+    return variants.get('source') != field_file.name
+
+
+def load_variants(value):
+    try:
+        return json.loads(value) if value else {}
+    except ValueError:
+        return {}
+
+
+def process(model, pk, field_name):
+    instance = model.objects.only(field_name).get(pk=pk)
+    field_file = getattr(instance, field_name)
+    if not field_file:
+        return
+    variants = make_variants(field_file)
+    # update() so saving the variants doesn't send post_save again
+    model.objects.filter(pk=pk).update(**{field_name + '_variants': json.dumps(variants)})
+    if model._meta.model_name == 'post':
+        response_cache.bump(LIST_VERSION, post_version(pk))
+    else:
+        response_cache.bump(LIST_VERSION)
+
+
+def _process_in_background(model, pk, field_name):
+    try:
+        process(model, pk, field_name)
+    except Exception:
+        logger.exception('Failed to make image variants for %s %s.', model.__name__, pk)
+    finally:
+        close_old_connections()
+
+
+def schedule(instance, field_name):
+    model, pk = type(instance), instance.pk
+    if getattr(settings, 'IMAGE_VARIANTS_SYNC', False):
+        process(model, pk, field_name)
+    else:
+        # the worker must see the committed row
+        transaction.on_commit(lambda: get_executor().submit(
+            _process_in_background, model, pk, field_name))
+
+
+def srcset(value, request=None):
+    # {"webp": "<url> 320w, <url> 640w", "jpeg": ...} for <picture> sources
+    from django.core.files.storage import default_storage
+
+    variants = load_variants(value)
+    result = {}
+    for key in FORMATS:
+        entries = []
+        for width, name in sorted(variants.get(key, {}).items(), key=lambda item: int(item[0])):
+            url = default_storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            entries.append('{} {}w'.format(url, width))
+        if entries:
+            result[key] = ', '.join(entries)
+    return result
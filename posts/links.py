@@ -0,0 +1,124 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .cache import response_cache, post_version, LIST_VERSION
+from .models import LINK_FIELDS, Post, PostCategory
+
+# Previous/next links. Every post links to the posts right before and
+# after it in its chain: its author's posts ordered by (timestamp, id),
+# or with POST_LINKS_PER_CATEGORY, its author's posts in its first
+# category (posts without a category have no links then). posts/signals.py
+# relinks the few posts around a post that is created, deleted,
+# re-timestamped or moved, with two lookups on post_author_timestamp_idx
+# per post, and relink_chains() rebuilds whole chains for bulk writes and
+# the relink_posts command.
+
+
+def per_category():
+    return getattr(settings, 'POST_LINKS_PER_CATEGORY', False)
+
+
+def chain_of(post):
+    # the posts in post's chain, None if it isn't in one
+    posts = Post.objects.filter(author_id=post.author_id)
+    if per_category():
+        category = PostCategory.objects.filter(post_id=post.id).order_by(
+            'category_id').values_list('category_id', flat=True).first()
+        if category is None:
+            return None
+        # posts whose first category is the same, as in relink_chains()
+        posts = posts.filter(category=category).exclude(category__lt=category)
+    return posts
+
+
+def neighbours(post):
+    posts = chain_of(post)
+    if posts is None:
+        return None, None
+    earlier = Q(timestamp__lt=post.timestamp) | Q(timestamp=post.timestamp, id__lt=post.id)
+    later = Q(timestamp__gt=post.timestamp) | Q(timestamp=post.timestamp, id__gt=post.id)
+    return (
+        posts.filter(earlier).order_by('-timestamp', '-id').values_list('id', flat=True).first(),
+        posts.filter(later).order_by('timestamp', 'id').values_list('id', flat=True).first(),
+    )
+
+
+def linked_posts(post_id):
+    # post_id, the posts it links to and the posts linking to it
+    rows = Post.objects.filter(
+        Q(id=post_id) | Q(previous_post=post_id) | Q(next_post=post_id)
+    ).values_list('id', 'previous_post_id', 'next_post_id')
+    return {post for row in rows for post in row if post is not None}
+
+
+def bump_links(post_ids):
+    versions = [LIST_VERSION] + [post_version(post_id) for post_id in post_ids]
+    transaction.on_commit(lambda: response_cache.bump(*versions))
+
+
+def relink(post_ids):
+    # recomputes the links of the given posts, returns those that changed
+    changed = []
+    posts = Post.objects.filter(id__in=set(post_ids) - {None}).only(
+        'id', 'author_id', 'timestamp', 'previous_post_id', 'next_post_id')
+    for post in posts:
+        links = neighbours(post)
+        if links != (post.previous_post_id, post.next_post_id):
+            # update() sends no post_save, so this doesn't recurse
+            Post.objects.filter(id=post.id).update(
+                previous_post_id=links[0], next_post_id=links[1])
+            changed.append(post.id)
+    if changed:
+        bump_links(changed)
+    return changed
+
+
+def update_links(post_id, before=()):
+    # relinks a post that was added or moved, its old neighbours (before)
+    # and its new ones
+    relink(set(before) | {post_id})
+    after = linked_posts(post_id) - set(before) - {post_id}
+    relink(after)
+
+
+def relink_chains(author_ids=None, batch_size=500):
+    # rebuilds every chain of the given authors (all by default) in bulk,
+    # returns the number of posts whose links changed
+    posts = Post.objects.order_by('author_id', 'timestamp', 'id')
+    categories = {}
+    if per_category():
+        rows = PostCategory.objects.order_by('post_id', 'category_id')
+        if author_ids is not None:
+            posts = posts.filter(author_id__in=author_ids)
+            rows = rows.filter(post__author_id__in=author_ids)
+        for post_id, category_id in rows.values_list('post_id', 'category_id').iterator():
+            categories.setdefault(post_id, category_id)
+    elif author_ids is not None:
+        posts = posts.filter(author_id__in=author_ids)
+
+    chains = {}
+    for post_id, author_id, previous_id, next_id in posts.values_list(
+            'id', 'author_id', 'previous_post_id', 'next_post_id').iterator():
+        if per_category():
+            key = (author_id, categories[post_id]) if post_id in categories else None
+        else:
+            key = author_id
+        chains.setdefault(key, []).append((post_id, previous_id, next_id))
+
+    changed = []
+    for key, chain in chains.items():
+        for index, (post_id, previous_id, next_id) in enumerate(chain):
+            links = (None, None)
+            if key is not None:
+                links = (chain[index - 1][0] if index > 0 else None,
+                         chain[index + 1][0] if index + 1 < len(chain) else None)
+            if links != (previous_id, next_id):
+                changed.append(Post(id=post_id, previous_post_id=links[0], next_post_id=links[1]))
+
+    for start in range(0, len(changed), batch_size):
+        with transaction.atomic():
+            Post.objects.bulk_update(changed[start:start + batch_size], LINK_FIELDS)
+    if changed:
+        bump_links([post.id for post in changed])
+    return len(changed)
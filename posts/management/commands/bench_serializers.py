@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+import timeit
+
+from posts.api.fast import FastPostSerializer, FastCommentSerializer
+from posts.api.serializers import PostSerializer, CommentSerializer
+from posts.models import Post, Comment
+
+
+class Command(BaseCommand):
+    help = 'Compares the DRF serializers with the fast read path on the current database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=50,
+                            help='Number of posts to serialize per run.')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Number of runs, the best one is reported.')
+
+    def handle(self, *args, **options):
+        # rows are loaded once, so only serialization is measured
+        posts = list(Post.objects.for_api()[:options['posts']])
+        comments = list(Comment.objects.select_related('user')[:options['posts']])
+
+        cases = [
+            ('posts', PostSerializer, FastPostSerializer, posts),
+            ('comments', CommentSerializer, FastCommentSerializer, comments),
+        ]
+        for name, serializer_class, fast_serializer_class, instances in cases:
+            drf = self.best(serializer_class, instances, options['repeat'])
+            fast = self.best(fast_serializer_class, instances, options['repeat'])
+            self.stdout.write('{}: {} rows, drf {:.2f} ms, fast {:.2f} ms, {:.1f}x'.format(
+                name, len(instances), drf * 1000, fast * 1000, drf / fast if fast else 0))
+
+    @staticmethod
+    def best(serializer_class, instances, repeat):
+        return min(timeit.repeat(
+            lambda: serializer_class(instances, many=True).data, number=1, repeat=repeat))
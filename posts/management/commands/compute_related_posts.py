@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from posts.recommendations import compute_related
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes the related posts of every post from shared viewers and '
+        'categories, on a pool of processes. Run it nightly, e.g. from cron; '
+        'the detail page and /api/users/recommended/ only read its output.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int,
+                            help='Related posts kept per post, RELATED_POSTS_COUNT by default.')
+        parser.add_argument('--workers', type=int,
+                            help='Scoring processes, RELATED_POSTS_WORKERS by default.')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Number of posts scored and written at a time.')
+
+    def handle(self, *args, **options):
+        rows = compute_related(options['count'], options['workers'], options['chunk_size'])
+        self.stdout.write('Wrote {} related posts.'.format(rows))
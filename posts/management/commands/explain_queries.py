@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+import json
+import re
+
+from posts.models import Post, PostCategory, Comment, PostView, Like, Category
+
+
+def get_querysets():
+    # the main queries behind posts/api/views.py, with placeholder ids
+    ordering = ('-timestamp', '-id')
+    feed = Post.objects.for_api(content=False).order_by(*ordering)
+    return [
+        ('posts', feed[:10]),
+        ('posts next page', feed.filter(timestamp__lt=timezone.now())[:10]),
+        ('posts featured', feed.filter(featured=True)[:10]),
+        ('posts by category', feed.filter(category__title='django')[:10]),
+        ('category posts', PostCategory.objects.filter(
+            category_id=1).order_by('-timestamp', '-post_id')[:10]),
+        ('post detail', Post.objects.for_api().filter(id=1)),
+        ('post comments', Comment.objects.filter(
+            post_id=1, parent__isnull=True).order_by(*ordering)[:20]),
+        ('comment replies', Comment.objects.filter(
+            post_id=1, path__gt='0000000001/', path__lt='00000000010').order_by('path')[:20]),
+        ('reading list', PostView.objects.filter(user_id=1).order_by(*ordering)[:10]),
+        ('my posts', Post.objects.filter(author__user_id=1).order_by(*ordering)[:10]),
+        ('liked posts', Like.objects.filter(user_id=1, post_id__in=[1, 2, 3])),
+        ('selected categories', Category.objects.filter(title__in=['django', 'react'])),
+    ]
+
+
+def find_full_scans(queryset):
+    # tables read without an index, per database vendor
+    if connection.vendor == 'mysql':
+        plan = json.loads(queryset.explain(format='JSON'))
+        return sorted(set(_mysql_full_scans(plan))), json.dumps(plan, indent=2)
+
+    plan = queryset.explain()
+    if connection.vendor == 'postgresql':
+        return sorted(set(re.findall(r'Seq Scan on (\w+)', plan))), plan
+
+    scans = []
+    for line in plan.splitlines():
+        match = re.search(r'\bSCAN (?:TABLE )?(\w+)(.*)', line)
+        if match and 'USING' not in match.group(2):
+            scans.append(match.group(1))
+    return sorted(set(scans)), plan
+
+
+def _mysql_full_scans(node):
+    if isinstance(node, dict):
+        if node.get('access_type') == 'ALL':
+            yield node.get('table_name')
+        values = node.values()
+    elif isinstance(node, list):
+        values = node
+    else:
+        return
+    for value in values:
+        yield from _mysql_full_scans(value)
+
+
+class Command(BaseCommand):
+    help = 'Runs EXPLAIN on the main API queries and flags full table scans.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true',
+                            help='Print the full query plans.')
+        parser.add_argument('--fail-on-scan', action='store_true',
+                            help='Exit with an error if any query scans a whole table.')
+
+    def handle(self, *args, **options):
+        flagged = []
+        for name, queryset in get_querysets():
+            scans, plan = find_full_scans(queryset)
+            if scans:
+                flagged.append(name)
+                self.stdout.write('{}: full scan of {}'.format(name, ', '.join(scans)))
+            else:
+                self.stdout.write('{}: ok'.format(name))
+            if options['verbose_plans']:
+                self.stdout.write(plan)
+
+        if flagged and options['fail_on_scan']:
+            raise CommandError('Full table scans in: {}'.format(', '.join(flagged)))
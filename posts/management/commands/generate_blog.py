@@ -0,0 +1,210 @@
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+from django.db.models import Case, DateTimeField, When
+from django.db.models.functions import Cast, Coalesce, Concat, LPad
+from django.utils import timezone
+import random
+
+from posts.cache import response_cache, LIST_VERSION, CATEGORY_INDEX_VERSION
+from posts.models import (
+    Author, Category, Comment, Like, Post, PostCategory, PostView, UserProfile
+)
+from posts.links import relink_chains
+from posts.rendering import render
+from posts.search import rebuild_index
+
+User = get_user_model()
+
+WORDS = (
+    'django query index cache serializer request response thread pool latency '
+    'database cursor page author post comment like view category search token '
+    'render template signal model field migration transaction commit rollback '
+    'python async worker queue batch stream buffer memory profile benchmark'
+).split()
+
+
+def sentence(rng, length):
+    words = [rng.choice(WORDS) for _ in range(length)]
+    return ' '.join(words).capitalize() + '.'
+
+
+def rich_text(rng, sections):
+    # CKEditor-like HTML: headed sections of a few paragraphs each
+    parts = []
+    for _ in range(sections):
+        parts.append('<h2>{}</h2>'.format(sentence(rng, 4)[:-1]))
+        for _ in range(rng.randint(2, 5)):
+            parts.append('<p>{} <strong>{}</strong> {}</p>'.format(
+                sentence(rng, 20), rng.choice(WORDS), sentence(rng, 30)))
+    return ''.join(parts)
+
+
+def pairs(rng, count, users, posts):
+    # count distinct (user, post) pairs
+    count = min(count, len(users) * len(posts))
+    for index in rng.sample(range(len(users) * len(posts)), count):
+        yield users[index // len(posts)], posts[index % len(posts)]
+
+
+def id_range(ids):
+    # the rows inserted by one insert() call, without a huge IN list
+    return (ids[0], ids[-1]) if ids else (0, -1)
+
+
+def chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = (
+        'Fills the database with a synthetic blog for benchmarking: users, authors, '
+        'categories, posts with long rich-text content linked in previous/next '
+        'chains, and likes, views and comments. The same --seed gives '
+        'the same blog.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000,
+                            help='Number of users, the first --authors of them write posts.')
+        parser.add_argument('--authors', type=int, default=20)
+        parser.add_argument('--categories', type=int, default=12)
+        parser.add_argument('--posts', type=int, default=2000)
+        parser.add_argument('--likes', type=int, default=100000)
+        parser.add_argument('--views', type=int, default=200000)
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument('--reply-ratio', type=float, default=0.3,
+                            help='Fraction of comments that are replies.')
+        parser.add_argument('--sections', type=int, default=6,
+                            help='Headed sections of content per post.')
+        parser.add_argument('--days', type=int, default=365,
+                            help='Posts are spread over this many past days.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='bench',
+                            help='Prefix of the generated usernames and category titles.')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Number of rows written per insert.')
+
+    def handle(self, *args, **options):
+        if options['authors'] > options['users']:
+            raise CommandError('--authors can\'t be more than --users.')
+        if User.objects.filter(username__startswith=options['prefix'] + '-').exists():
+            raise CommandError(
+                'Users named {}-* already exist, pick another --prefix.'.format(options['prefix']))
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+
+        users = self.create_users(options['prefix'], options['users'])
+        authors = self.create_authors(users[:options['authors']])
+        categories = self.create_categories(options['prefix'], options['categories'])
+        posts = self.create_posts(authors, categories, options)
+        relink_chains(authors)
+
+        self.insert(Like, (Like(user_id=user, post_id=post)
+                           for user, post in pairs(self.rng, options['likes'], users, posts)))
+        self.insert(PostView, (
+            PostView(user_id=user, post_id=post, timestamp=self.random_time(options['days']))
+            for user, post in pairs(self.rng, options['views'], users, posts)))
+        self.create_comments(users, posts, options['comments'], options['reply_ratio'])
+
+        self.stdout.write('Counting and indexing...')
+        Post.objects.filter(id__range=id_range(posts)).recount()
+        Category.objects.filter(id__in=categories).recount()
+        rebuild_index()
+        response_cache.bump(LIST_VERSION, CATEGORY_INDEX_VERSION)
+
+        self.stdout.write('Created {} users, {} authors, {} posts, {} likes, {} views and {} comments.'.format(
+            len(users), len(authors), len(posts),
+            Like.objects.filter(post__id__range=id_range(posts)).count(),
+            PostView.objects.filter(post__id__range=id_range(posts)).count(),
+            Comment.objects.filter(post__id__range=id_range(posts)).count()))
+
+    def insert(self, model, rows):
+        # ids are read back afterwards, bulk_create only returns them on PostgreSQL
+        last_id = model.objects.aggregate(last=models.Max('id'))['last'] or 0
+        for chunk in chunks(rows, self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(chunk)
+        return list(model.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True))
+
+    def random_time(self, days):
+        return self.now - timedelta(seconds=self.rng.randint(0, days * 24 * 60 * 60))
+
+    def create_users(self, prefix, count):
+        users = self.insert(User, (
+            User(username='{}-{}'.format(prefix, number), password='!')
+            for number in range(count)))
+        self.insert(UserProfile, (UserProfile(user_id=user) for user in users))
+        return users
+
+    def create_authors(self, users):
+        return self.insert(Author, (Author(user_id=user) for user in users))
+
+    def create_categories(self, prefix, count):
+        return self.insert(Category, (
+            Category(title='{}-{}'.format(prefix, number)[:20]) for number in range(count)))
+
+    def create_posts(self, authors, categories, options):
+        # a pool of rendered contents, rendering every post would dominate
+        contents = []
+        for _ in range(min(options['posts'], 50)):
+            content = rich_text(self.rng, options['sections'])
+            contents.append(dict(render(content), content=content))
+
+        self.stdout.write('Creating posts...')
+        posts = self.insert(Post, (
+            Post(title=sentence(self.rng, 5)[:100], overview=sentence(self.rng, 25),
+                 author_id=self.rng.choice(authors), featured=self.rng.random() < 0.05,
+                 **self.rng.choice(contents))
+            for _ in range(options['posts'])))
+
+        # timestamp is auto_now_add, so the spread is set afterwards
+        self.timestamps = {post: self.random_time(options['days']) for post in posts}
+        for chunk in chunks(posts, 500):
+            Post.objects.filter(id__range=id_range(chunk)).update(timestamp=Case(
+                *[When(id=post, then=self.timestamps[post]) for post in chunk],
+                output_field=DateTimeField()))
+
+        self.insert(PostCategory, (
+            PostCategory(post_id=post, category_id=category, timestamp=self.timestamps[post])
+            for post in posts
+            for category in self.rng.sample(categories, min(len(categories), self.rng.randint(1, 3)))))
+        return posts
+
+    def create_comments(self, users, posts, count, reply_ratio):
+        replies = int(count * reply_ratio)
+        threads = self.insert(Comment, (
+            Comment(user_id=self.rng.choice(users), post_id=self.rng.choice(posts),
+                    content=sentence(self.rng, 15))
+            for _ in range(count - replies)))
+        if not threads:
+            return
+
+        parents = dict(Comment.objects.filter(id__range=id_range(threads)).values_list('id', 'post_id'))
+        chosen = [self.rng.choice(threads) for _ in range(replies)]
+        self.insert(Comment, (
+            Comment(user_id=self.rng.choice(users), post_id=parents[parent],
+                    parent_id=parent, depth=1, content=sentence(self.rng, 15))
+            for parent in chosen))
+
+        # the same paths Comment.save gives, see migration 0004
+        padded_id = LPad(Cast('id', models.CharField(max_length=10)), 10, models.Value('0'))
+        Comment.objects.filter(id__range=id_range(threads)).update(path=Concat(
+            padded_id, models.Value('/'), output_field=models.CharField()))
+        Comment.objects.filter(parent__id__range=id_range(threads), path='').update(path=Concat(
+            models.Subquery(Comment.objects.filter(id=models.OuterRef('parent_id')).values('path')[:1]),
+            padded_id, models.Value('/'), output_field=models.CharField()))
+        Comment.objects.filter(id__range=id_range(threads)).update(reply_count=Coalesce(models.Subquery(
+            Comment.objects.filter(parent=models.OuterRef('pk')).order_by().values('parent')
+            .annotate(count=models.Count('pk')).values('count'),
+            output_field=models.IntegerField()), 0))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from posts.images import needs_variants, process
+from posts.models import Post, Author
+
+
+class Command(BaseCommand):
+    help = 'Makes the resized variants of post thumbnails and profile images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Remake variants that are already up to date.')
+
+    def handle(self, *args, **options):
+        for model, field_name in [(Post, 'thumbnail'), (Author, 'profile_image')]:
+            done = 0
+            instances = model.objects.exclude(**{field_name: ''}).exclude(
+                **{field_name + '__isnull': True}).only('id', field_name, field_name + '_variants')
+            for instance in instances.iterator():
+                if options['force'] or needs_variants(instance, field_name):
+                    process(model, instance.pk, field_name)
+                    done += 1
+            self.stdout.write('Made variants for {} {} images.'.format(done, model.__name__.lower()))
@@ -0,0 +1,115 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, DateTimeField, Max, When
+from django.utils.dateparse import parse_datetime
+import json
+
+from posts.cache import response_cache, LIST_VERSION, CATEGORY_INDEX_VERSION
+from posts.links import relink_chains
+from posts.models import Post, PostCategory, Author, Category
+from posts.rendering import render_post
+from posts.search import index_posts
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports posts from a JSON Lines file, one post per line with title, '
+        'overview, content, author (username) and categories (titles), and '
+        'optionally timestamp, featured and thumbnail.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='JSON Lines file to import.')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Number of posts written per transaction.')
+
+    def handle(self, *args, **options):
+        imported = 0
+        with open(options['path']) as f:
+            chunk = []
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    chunk.append(json.loads(line))
+                except ValueError as e:
+                    raise CommandError('Line {}: {}'.format(line_number, e))
+
+                if len(chunk) >= options['chunk_size']:
+                    imported += self.import_chunk(chunk)
+                    chunk = []
+            if chunk:
+                imported += self.import_chunk(chunk)
+
+        # bulk_create sends no signals
+        response_cache.bump(LIST_VERSION, CATEGORY_INDEX_VERSION)
+        self.stdout.write('Imported {} posts.'.format(imported))
+
+    @transaction.atomic
+    def import_chunk(self, rows):
+        authors = self.get_authors({row['author'] for row in rows})
+        categories = self.get_categories(
+            {title for row in rows for title in row.get('categories', [])})
+
+        posts = [
+            Post(
+                title=row['title'],
+                overview=row['overview'],
+                content=row['content'],
+                author=authors[row['author']],
+                featured=row.get('featured', False),
+                thumbnail=row.get('thumbnail', None),
+            )
+            for row in rows
+        ]
+        # bulk_create skips Post.save, which renders the content
+        for post in posts:
+            render_post(post)
+        # ids are read back afterwards, bulk_create only returns them on PostgreSQL
+        last_id = Post.objects.aggregate(last=Max('id'))['last'] or 0
+        Post.objects.bulk_create(posts)
+        ids = list(Post.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True))
+        if len(ids) != len(posts):
+            raise CommandError('Posts were created by someone else during the import, try again.')
+        for post, post_id in zip(posts, ids):
+            post.id = post_id
+        index_posts(posts)
+
+        # timestamp is auto_now_add, so imported values are set afterwards
+        for post, row in zip(posts, rows):
+            if row.get('timestamp'):
+                post.timestamp = parse_datetime(row['timestamp'])
+        timestamps = [When(id=post.id, then=post.timestamp)
+                      for post, row in zip(posts, rows) if row.get('timestamp')]
+        if timestamps:
+            Post.objects.filter(id__in=[post.id for post in posts]).update(
+                timestamp=Case(*timestamps, default='timestamp', output_field=DateTimeField()))
+
+        PostCategory.objects.bulk_create([
+            PostCategory(post_id=post.id, category_id=categories[title].id, timestamp=post.timestamp)
+            for post, row in zip(posts, rows)
+            for title in set(row.get('categories', []))
+        ])
+        Category.objects.filter(id__in=[category.id for category in categories.values()]).recount()
+        # the imported timestamps move posts around in their chains
+        relink_chains({post.author_id for post in posts})
+        return len(posts)
+
+    def get_authors(self, usernames):
+        users = {user.username: user for user in User.objects.filter(username__in=usernames)}
+        missing = usernames - users.keys()
+        if missing:
+            raise CommandError('Unknown authors: {}'.format(', '.join(sorted(missing))))
+
+        Author.objects.bulk_create(
+            [Author(user=user) for user in users.values()], ignore_conflicts=True)
+        authors = Author.objects.filter(user__in=users.values()).select_related('user')
+        return {author.user.username: author for author in authors}
+
+    def get_categories(self, titles):
+        Category.objects.bulk_create(
+            [Category(title=title) for title in titles], ignore_conflicts=True)
+        return {category.title: category for category in Category.objects.filter(title__in=titles)}
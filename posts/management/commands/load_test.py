@@ -0,0 +1,89 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+import itertools
+import json
+import requests
+import threading
+import time
+
+from posts.metrics import percentile
+
+DEFAULT_PATHS = ['/api/posts/', '/api/posts/1/', '/api/categories/']
+
+
+class Command(BaseCommand):
+    help = (
+        'Sends the same read traffic to one or more running servers and compares '
+        'requests/sec and latency, e.g. the WSGI and ASGI deployments on the same '
+        'database: "load_test wsgi=http://127.0.0.1:8001 asgi=http://127.0.0.1:8002".'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='+', metavar='name=url',
+                            help='Servers to test, each as name=base url.')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Path to request, repeat for several (default: {}).'.format(
+                                ', '.join(DEFAULT_PATHS)))
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Number of requests per server.')
+        parser.add_argument('--concurrency', type=int, default=32,
+                            help='Number of requests in flight at once.')
+        parser.add_argument('--warmup', type=int, default=50,
+                            help='Requests sent before measuring.')
+        parser.add_argument('--token', help='Bearer token sent with every request.')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['targets']:
+            name, _, url = target.partition('=')
+            if not url:
+                raise CommandError('Expected name=url, got "{}".'.format(target))
+            targets.append((name, url.rstrip('/')))
+
+        results = {}
+        for name, url in targets:
+            self.run(url, options, options['warmup'])
+            results[name] = self.run(url, options, options['requests'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name, result in results.items():
+            self.stdout.write(
+                '{}: {requests} requests, {errors} errors, {rps:.1f} req/s, '
+                'p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms'.format(name, **result))
+
+    def run(self, url, options, count):
+        paths = itertools.cycle(options['paths'] or DEFAULT_PATHS)
+        urls = [url + next(paths) for _ in range(count)]
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = 'Bearer ' + options['token']
+        local = threading.local()
+
+        def send(request_url):
+            # one keep-alive connection per client thread
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+            started = time.perf_counter()
+            try:
+                ok = local.session.get(request_url, headers=headers, timeout=30).status_code < 400
+            except requests.RequestException:
+                ok = False
+            return time.perf_counter() - started, ok
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            samples = list(executor.map(send, urls))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency * 1000 for latency, ok in samples if ok)
+        return {
+            'requests': count,
+            'errors': sum(1 for _, ok in samples if not ok),
+            'rps': count / elapsed if elapsed else 0.0,
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+        }
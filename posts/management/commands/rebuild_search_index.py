@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models import PostSearch
+from posts.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index from all posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of posts indexed per insert.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_index(options['batch_size'])
+        self.stdout.write('Indexed {} posts.'.format(PostSearch.objects.count()))
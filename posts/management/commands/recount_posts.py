@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.models import Post, Category, Like, PostView, Comment, count_subquery
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the denormalized post and category counts, or checks the post counts with --check.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Report posts whose counts are out of date without fixing them.')
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            updated = Post.objects.recount()
+            categories = Category.objects.recount()
+            self.stdout.write('Recounted {} posts and {} categories.'.format(updated, categories))
+            return
+
+        posts = Post.objects.annotate(
+            actual_likes=count_subquery(Like),
+            actual_views=count_subquery(PostView),
+            actual_comments=count_subquery(Comment),
+        ).values_list(
+            'id', 'likes_count', 'actual_likes', 'views_count', 'actual_views',
+            'comments_count', 'actual_comments')
+
+        stale = 0
+        for post_id, likes, actual_likes, views, actual_views, comments, actual_comments in posts.iterator():
+            if (likes, views, comments) != (actual_likes, actual_views, actual_comments):
+                stale += 1
+                self.stdout.write(
+                    'Post {}: likes {}/{}, views {}/{}, comments {}/{}'.format(
+                        post_id, likes, actual_likes, views, actual_views,
+                        comments, actual_comments))
+
+        if stale:
+            raise CommandError(
+                '{} posts have stale counts, run recount_posts to fix them.'.format(stale))
+        self.stdout.write('All post counts are up to date.')
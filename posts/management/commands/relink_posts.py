@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from posts.links import relink_chains
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the previous/next links of every post from its position in '
+        'its author\'s posts (per category with POST_LINKS_PER_CATEGORY). Run it '
+        'after changing that setting or writing posts without signals.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--author', type=int, action='append', dest='authors',
+                            help='Only relink this author\'s posts, can be repeated.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of posts updated per query.')
+
+    def handle(self, *args, **options):
+        relinked = relink_chains(options['authors'], options['batch_size'])
+        self.stdout.write('Relinked {} posts.'.format(relinked))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.cache import response_cache, post_version, LIST_VERSION
+from posts.models import Post
+from posts.rendering import RENDERED_FIELDS, render_post
+
+
+class Command(BaseCommand):
+    help = 'Re-renders the sanitized HTML, excerpt, reading time and TOC of posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Re-render posts whose content has not changed.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of posts updated per query.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        posts = Post.objects.only('id', 'content', 'content_hash').order_by('id')
+        batch, total = [], 0
+        for post in posts.iterator(chunk_size=batch_size):
+            if render_post(post, force=options['force']):
+                batch.append(post)
+            if len(batch) >= batch_size:
+                total += self.save(batch)
+                batch = []
+        total += self.save(batch)
+        self.stdout.write('Rendered {} posts.'.format(total))
+
+    def save(self, posts):
+        with transaction.atomic():
+            Post.objects.bulk_update(posts, RENDERED_FIELDS)
+        response_cache.bump(LIST_VERSION, *[post_version(post.id) for post in posts])
+        return len(posts)
@@ -0,0 +1,36 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from posts.buffers import engagement_events
+from posts.engagement import prune, roll_up
+
+
+class Command(BaseCommand):
+    help = (
+        'Adds the engagement events logged since the last run to the hourly and '
+        'daily per-post counts that /api/posts/trending/ ranks posts from. Run it '
+        'every few minutes, e.g. from cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Number of events counted per transaction.')
+        parser.add_argument('--keep-events', type=int, metavar='DAYS',
+                            help='Delete counted events older than this many days.')
+        parser.add_argument('--keep-hourly', type=int, default=7, metavar='DAYS',
+                            help='Delete hourly counts older than this many days, '
+                                 'the daily counts are kept.')
+
+    def handle(self, *args, **options):
+        # events buffered by this process, e.g. when run from a shell
+        engagement_events.flush()
+        counted = roll_up(options['batch_size'])
+
+        now = timezone.now()
+        deleted = prune(
+            events_before=(now - timedelta(days=options['keep_events'])
+                           if options['keep_events'] is not None else None),
+            hourly_before=now - timedelta(days=options['keep_hourly']))
+        self.stdout.write('Counted {} events, deleted {} events and {} hourly counts.'.format(
+            counted, deleted['events'], deleted['hourly']))
@@ -0,0 +1,162 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+import json
+import subprocess
+import time
+
+from posts.api import urls
+from posts.cache import response_cache
+from posts.metrics import percentile
+from posts.models import Category, Comment, Like, Post
+
+User = get_user_model()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_host():
+    # a host name the requests pass ALLOWED_HOSTS with
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            return host.lstrip('.')
+    return 'localhost'
+
+
+class Command(BaseCommand):
+    help = (
+        'Requests every route in posts/api/urls.py through the test client against '
+        'the current database and prints latency percentiles, query counts and '
+        'payload sizes as JSON, to compare between commits. Fill the database '
+        'with generate_blog first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50,
+                            help='Requests per route.')
+        parser.add_argument('--warmup', type=int, default=3,
+                            help='Unmeasured requests per route.')
+        parser.add_argument('--cold', action='store_true',
+                            help='Empty the response cache before every request.')
+        parser.add_argument('--username',
+                            help='User the requests are made as, by default a staff user.')
+        parser.add_argument('--output', help='Write the JSON to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        self.user = self.get_user(options['username'])
+        self.client = APIClient(SERVER_NAME=get_host())
+        self.client.force_authenticate(self.user)
+
+        routes = {}
+        for name, method, path in self.get_requests():
+            routes[name] = self.measure(method, path, options)
+        # like-post toggles, put the like back the way it was
+        if Like.objects.filter(user=self.user, post=self.post).exists() != self.liked:
+            self.client.post('/api/posts/{}/like/'.format(self.post.id))
+
+        report = {
+            'commit': git_commit(),
+            'timestamp': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'rows': {
+                'posts': Post.objects.count(),
+                'comments': Comment.objects.count(),
+                'users': User.objects.count(),
+            },
+            'iterations': options['iterations'],
+            'cold': options['cold'],
+            'routes': routes,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def get_user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError('No user named "{}".'.format(username))
+        user = User.objects.filter(is_staff=True).order_by('id').first()
+        if user is None:
+            user = User.objects.order_by('id').first()
+        if user is None:
+            raise CommandError('The database has no users, run generate_blog first.')
+        return user
+
+    def get_requests(self):
+        post = self.post = Post.objects.order_by('-likes_count', 'id').first()
+        comment = Comment.objects.filter(parent__isnull=True).order_by('-reply_count', 'id').first()
+        category = Category.objects.order_by('-post_count', 'id').first()
+        if post is None or comment is None or category is None:
+            raise CommandError('The database needs posts, comments and categories, run generate_blog first.')
+        self.liked = Like.objects.filter(user=self.user, post=post).exists()
+
+        # one request per route, GET unless the route has none
+        paths = {
+            'posts': '/api/posts/',
+            'liked-posts': '/api/posts/liked/?ids={}'.format(post.id),
+            'search-posts': '/api/posts/search/?q={}'.format(post.title.split()[0]),
+            'trending-posts': '/api/posts/trending/',
+            'post-detail': '/api/posts/{}/'.format(post.id),
+            'create-comment': '/api/posts/{}/comments/'.format(post.id),
+            'like-post': '/api/posts/{}/like/'.format(post.id),
+            'comment-replies': '/api/comments/{}/replies/'.format(comment.id),
+            'get-categories': '/api/categories/',
+            'category-posts': '/api/categories/{}/posts/'.format(category.id),
+            'get-user-id': '/api/users/id/',
+            'recommended-posts': '/api/users/recommended/',
+            'user-profile': '/api/users/{}/profile/'.format(self.user.userprofile.id),
+            'metrics': '/api/metrics/',
+        }
+        requests = []
+        for pattern in urls.urlpatterns:
+            if pattern.name not in paths:
+                raise CommandError('No benchmark request for the "{}" route.'.format(pattern.name))
+            method = 'post' if pattern.name == 'like-post' else 'get'
+            requests.append((pattern.name, method, paths[pattern.name]))
+        return requests
+
+    def measure(self, method, path, options):
+        send = getattr(self.client, method)
+        for _ in range(options['warmup']):
+            send(path)
+
+        latencies, queries, sizes, statuses = [], [], [], set()
+        for _ in range(options['iterations']):
+            if options['cold']:
+                response_cache.cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = send(path)
+                latencies.append((time.perf_counter() - started) * 1000)
+            queries.append(len(captured))
+            sizes.append(len(response.content))
+            statuses.add(response.status_code)
+
+        latencies.sort()
+        return {
+            'method': method.upper(),
+            'path': path,
+            'status': sorted(statuses),
+            'latency_ms': {
+                'p50': round(percentile(latencies, 0.50), 3),
+                'p95': round(percentile(latencies, 0.95), 3),
+                'p99': round(percentile(latencies, 0.99), 3),
+            },
+            'queries': {'min': min(queries), 'max': max(queries)},
+            'bytes': {'min': min(sizes), 'max': max(sizes)},
+        }
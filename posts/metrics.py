@@ -0,0 +1,114 @@
+from collections import deque
+from django.conf import settings
+import math
+import threading
+import time
+
+# In-memory request metrics, recorded by posts.middleware. Each URL name
+# keeps its last REQUEST_METRICS_WINDOW requests, and stats() reports the
+# p50/p95/p99 of the total time, database time and query count, and of
+# the time spent in serializers (including any query they trigger).
+
+FIELDS = ['total_ms', 'db_ms', 'queries', 'serializer_ms']
+
+
+def percentile(values, fraction):
+    # nearest-rank percentile of a sorted list
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class RequestRecord:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total_ms = 0.0
+        self.db_ms = 0.0
+        self.queries = 0
+        self.serializer_ms = 0.0
+        self._serializer_depth = 0
+
+    def query_wrapper(self, execute, sql, params, many, context):
+        # installed with connection.execute_wrapper() for the request
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_ms += (time.perf_counter() - started) * 1000
+
+    def finish(self):
+        self.total_ms = (time.perf_counter() - self.started) * 1000
+
+
+class SerializerTimer:
+    # times the outermost serializer call only, nested ones are part of it
+
+    def __init__(self, record):
+        self.record = record
+
+    def __enter__(self):
+        if self.record is not None:
+            if self.record._serializer_depth == 0:
+                self.started = time.perf_counter()
+            self.record._serializer_depth += 1
+
+    def __exit__(self, *exc_info):
+        if self.record is not None:
+            self.record._serializer_depth -= 1
+            if self.record._serializer_depth == 0:
+                self.record.serializer_ms += (time.perf_counter() - self.started) * 1000
+
+
+class RequestMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._samples = {}
+
+    def _window(self):
+        return getattr(settings, 'REQUEST_METRICS_WINDOW', 1000)
+
+    def begin(self):
+        record = RequestRecord()
+        self._local.record = record
+        return record
+
+    def current(self):
+        return getattr(self._local, 'record', None)
+
+    def serializer_timer(self):
+        return SerializerTimer(self.current())
+
+    def end(self, name, record):
+        record.finish()
+        self._local.record = None
+        sample = tuple(getattr(record, field) for field in FIELDS)
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None or samples.maxlen != self._window():
+                samples = self._samples[name] = deque(samples or (), maxlen=self._window())
+            samples.append(sample)
+
+    def stats(self):
+        with self._lock:
+            samples = {name: list(values) for name, values in self._samples.items()}
+
+        stats = {}
+        for name, values in samples.items():
+            stats[name] = {'count': len(values)}
+            for index, field in enumerate(FIELDS):
+                column = sorted(value[index] for value in values)
+                stats[name][field] = {
+                    'p50': percentile(column, 0.50),
+                    'p95': percentile(column, 0.95),
+                    'p99': percentile(column, 0.99),
+                }
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._samples = {}
+
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,64 @@
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+import cProfile
+import logging
+import os
+import random
+import time
+
+from .metrics import request_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RequestMetricsMiddleware:
+    # Records the query count and time, serializer time and total time of
+    # every request under its URL name, and reports them to the client in
+    # a Server-Timing header. With REQUEST_PROFILE_SAMPLE_RATE set, that
+    # fraction of requests also runs under cProfile, and the profile is
+    # saved to REQUEST_PROFILE_DIR when the request took longer than
+    # REQUEST_PROFILE_THRESHOLD_MS.
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        record = request_metrics.begin()
+        profiler = None
+        if random.random() < getattr(settings, 'REQUEST_PROFILE_SAMPLE_RATE', 0.0):
+            profiler = cProfile.Profile()
+
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(record.query_wrapper))
+            if profiler is not None:
+                profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+
+        match = getattr(request, 'resolver_match', None)
+        name = match.url_name if match is not None and match.url_name else 'unresolved'
+        request_metrics.end(name, record)
+
+        response['Server-Timing'] = (
+            'db;dur={:.1f};desc="{} queries", serializer;dur={:.1f}, total;dur={:.1f}'.format(
+                record.db_ms, record.queries, record.serializer_ms, record.total_ms))
+
+        if profiler is not None and record.total_ms >= getattr(
+                settings, 'REQUEST_PROFILE_THRESHOLD_MS', 500):
+            self.save_profile(profiler, name, record)
+        return response
+
+    def save_profile(self, profiler, name, record):
+        directory = settings.REQUEST_PROFILE_DIR
+        path = os.path.join(directory, '{}-{}-{:.0f}ms.prof'.format(
+            name, int(time.time() * 1000), record.total_ms))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            profiler.dump_stats(path)
+        except OSError:
+            logger.exception('Failed to save the profile of a slow %s request.', name)
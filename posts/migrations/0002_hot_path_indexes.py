@@ -0,0 +1,112 @@
+# Generated by Django 2.2.13 on 2026-10-18 10:30
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+import django.utils.timezone
+
+
+def remove_duplicates(apps, schema_editor):
+    # rows the new unique constraints would reject
+    Like = apps.get_model('posts', 'Like')
+    PostView = apps.get_model('posts', 'PostView')
+    Category = apps.get_model('posts', 'Category')
+    Post = apps.get_model('posts', 'Post')
+
+    for model in [Like, PostView]:
+        duplicates = model.objects.values('user', 'post').annotate(
+            first=models.Min('id'), count=models.Count('id')).filter(count__gt=1)
+        for row in duplicates:
+            model.objects.filter(user=row['user'], post=row['post']).exclude(
+                id=row['first']).delete()
+
+    # categories with the same title are merged into the oldest one
+    Through = Post.category.through
+    duplicates = Category.objects.values('title').annotate(
+        first=models.Min('id'), count=models.Count('id')).filter(count__gt=1)
+    for row in duplicates:
+        others = Category.objects.filter(title=row['title']).exclude(id=row['first'])
+        tagged = Through.objects.filter(category_id=row['first']).values('post_id')
+        Through.objects.filter(category__in=others).exclude(post_id__in=tagged).update(
+            category_id=row['first'])
+        others.delete()
+
+
+def count_rows(model):
+    rows = model.objects.filter(post=models.OuterRef('pk')).order_by()
+    return Coalesce(models.Subquery(
+        rows.values('post').annotate(count=models.Count('pk')).values('count'),
+        output_field=models.IntegerField()), 0)
+
+
+def fill_counts(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Post.objects.update(
+        likes_count=count_rows(apps.get_model('posts', 'Like')),
+        views_count=count_rows(apps.get_model('posts', 'PostView')),
+        comments_count=count_rows(apps.get_model('posts', 'Comment')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='views_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='postview',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.RunPython(fill_counts, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='category',
+            name='title',
+            field=models.CharField(max_length=20, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', '-timestamp', '-id'], name='comment_post_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-timestamp', '-id'], name='post_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['featured', '-timestamp', '-id'], name='post_featured_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', '-timestamp', '-id'], name='post_author_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postview',
+            index=models.Index(fields=['user', '-timestamp', '-id'], name='postview_user_timestamp_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='like',
+            constraint=models.UniqueConstraint(fields=('user', 'post'), name='unique_like'),
+        ),
+        migrations.AddConstraint(
+            model_name='postview',
+            constraint=models.UniqueConstraint(fields=('user', 'post'), name='unique_post_view'),
+        ),
+    ]
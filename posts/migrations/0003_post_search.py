@@ -0,0 +1,85 @@
+# Generated by Django 2.2.13 on 2026-10-18 10:32
+
+from django.db import migrations, models
+from django.utils.html import strip_tags
+import django.db.models.deletion
+import html
+
+SQLITE_INDEX = [
+    """CREATE VIRTUAL TABLE posts_postsearch_fts USING fts5(
+        title, overview, content, content='posts_postsearch', content_rowid='post_id')""",
+    """CREATE TRIGGER posts_postsearch_ai AFTER INSERT ON posts_postsearch BEGIN
+        INSERT INTO posts_postsearch_fts(rowid, title, overview, content)
+        VALUES (new.post_id, new.title, new.overview, new.content);
+    END""",
+    """CREATE TRIGGER posts_postsearch_ad AFTER DELETE ON posts_postsearch BEGIN
+        INSERT INTO posts_postsearch_fts(posts_postsearch_fts, rowid, title, overview, content)
+        VALUES ('delete', old.post_id, old.title, old.overview, old.content);
+    END""",
+    """CREATE TRIGGER posts_postsearch_au AFTER UPDATE ON posts_postsearch BEGIN
+        INSERT INTO posts_postsearch_fts(posts_postsearch_fts, rowid, title, overview, content)
+        VALUES ('delete', old.post_id, old.title, old.overview, old.content);
+        INSERT INTO posts_postsearch_fts(rowid, title, overview, content)
+        VALUES (new.post_id, new.title, new.overview, new.content);
+    END""",
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER posts_postsearch_au',
+    'DROP TRIGGER posts_postsearch_ad',
+    'DROP TRIGGER posts_postsearch_ai',
+    'DROP TABLE posts_postsearch_fts',
+]
+
+MYSQL_INDEX = [
+    'CREATE FULLTEXT INDEX posts_postsearch_fulltext ON posts_postsearch (title, overview, content)',
+]
+
+MYSQL_DROP = [
+    'DROP INDEX posts_postsearch_fulltext ON posts_postsearch',
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+def index_posts(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    PostSearch = apps.get_model('posts', 'PostSearch')
+    PostSearch.objects.bulk_create([
+        PostSearch(
+            post_id=post.id,
+            title=post.title,
+            overview=post.overview,
+            content=html.unescape(strip_tags(post.content or '')),
+        )
+        for post in Post.objects.only('id', 'title', 'overview', 'content').iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0002_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostSearch',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='posts.Post')),
+                ('title', models.CharField(max_length=100)),
+                ('overview', models.TextField()),
+                ('content', models.TextField()),
+            ],
+        ),
+        migrations.RunPython(
+            run_for_vendor({'sqlite': SQLITE_INDEX, 'mysql': MYSQL_INDEX}),
+            run_for_vendor({'sqlite': SQLITE_DROP, 'mysql': MYSQL_DROP}),
+        ),
+        migrations.RunPython(index_posts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 2.2.13 on 2026-10-18 10:34
+
+from django.db import migrations, models
+from django.db.models.functions import Cast, Concat, LPad
+import django.db.models.deletion
+
+
+def set_paths(apps, schema_editor):
+    # existing comments are all top-level
+    Comment = apps.get_model('posts', 'Comment')
+    Comment.objects.update(path=Concat(
+        LPad(Cast('id', models.CharField(max_length=10)), 10, models.Value('0')),
+        models.Value('/'),
+        output_field=models.CharField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0003_post_search'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_post_timestamp_idx',
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='posts.Comment'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(set_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'parent', '-timestamp', '-id'], name='comment_thread_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+        ),
+    ]
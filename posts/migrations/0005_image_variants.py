@@ -0,0 +1,23 @@
+# Generated by Django 2.2.13 on 2026-10-18 10:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0004_comment_threads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='profile_image_variants',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='thumbnail_variants',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 2.2.13 on 2026-10-18 10:42
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def fill_category_index(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    PostCategory = apps.get_model('posts', 'PostCategory')
+    Category = apps.get_model('posts', 'Category')
+
+    PostCategory.objects.update(timestamp=models.Subquery(
+        Post.objects.filter(id=models.OuterRef('post_id')).values('timestamp')[:1]))
+
+    rows = PostCategory.objects.filter(category=models.OuterRef('pk')).order_by().values('category')
+    Category.objects.update(
+        post_count=Coalesce(models.Subquery(
+            rows.annotate(count=models.Count('pk')).values('count'),
+            output_field=models.IntegerField()), 0),
+        latest_post_at=models.Subquery(
+            rows.annotate(latest=models.Max('timestamp')).values('latest'),
+            output_field=models.DateTimeField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_rendered_content'),
+    ]
+
+    operations = [
+        # PostCategory takes over the table Django created for Post.category
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='PostCategory',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='posts.Category')),
+                        ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='posts.Post')),
+                    ],
+                    options={
+                        'db_table': 'posts_post_category',
+                        'unique_together': {('post', 'category')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='post',
+                    name='category',
+                    field=models.ManyToManyField(through='posts.PostCategory', to='posts.Category'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='postcategory',
+            name='timestamp',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='postcategory',
+            index=models.Index(fields=['category', '-timestamp', '-post'], name='post_category_timestamp_idx'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='latest_post_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_category_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.13 on 2026-10-18 10:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0009_related_posts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='next_post',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='next', to='posts.Post'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='previous_post',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='previous', to='posts.Post'),
+        ),
+    ]
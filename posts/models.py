@@ -1,9 +1,13 @@
 from django.db import models
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 from ckeditor.fields import RichTextField
 
+from .rendering import LONG_FIELDS, RENDERED_FIELDS, render_post
+
 User = get_user_model()
 
 
@@ -26,6 +30,8 @@ class Author(models.Model):
     user = models.OneToOneField(
         User, on_delete=models.CASCADE)
     profile_image = models.ImageField()
+    # resized copies, see posts/images.py
+    profile_image_variants = models.TextField(blank=True, default='', editable=False)
 
     def __str__(self):
         return self.user.username
@@ -38,14 +44,32 @@ class Like(models.Model):
     def __str__(self):
         return self.user.username
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'], name='unique_like'),
+        ]
+
 
 class PostView(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     post = models.ForeignKey('Post', on_delete=models.CASCADE)
+    # last time the user viewed the post
+    timestamp = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
         return self.user.username
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'], name='unique_post_view'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-timestamp', '-id'],
+                         name='postview_user_timestamp_idx'),
+        ]
+
 
 class Comment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -54,14 +78,64 @@ class Comment(models.Model):
     post = models.ForeignKey(
         'Post', related_name='comments', on_delete=models.CASCADE)
 
-    # reply
+    # reply, stored with a materialized path of zero-padded ancestor ids
+    # so a whole subtree is one ordered range scan on (post, path)
+    parent = models.ForeignKey(
+        'self', related_name='replies', on_delete=models.CASCADE, blank=True, null=True)
+    path = models.CharField(max_length=255, editable=False, default='')
+    depth = models.PositiveSmallIntegerField(editable=False, default=0)
+    reply_count = models.PositiveIntegerField(editable=False, default=0)
 
     def __str__(self):
         return self.user.username
 
+    def save(self, *args, **kwargs):
+        created = self.pk is None
+        if created:
+            # past the maximum depth, replies go next to their parent
+            while self.parent is not None and self.parent.depth >= settings.COMMENT_MAX_DEPTH:
+                self.parent = self.parent.parent
+        super().save(*args, **kwargs)
+
+        if created:
+            prefix = self.parent.path if self.parent is not None else ''
+            self.path = '{}{:010d}/'.format(prefix, self.id)
+            self.depth = self.parent.depth + 1 if self.parent is not None else 0
+            Comment.objects.filter(id=self.id).update(
+                path=self.path, depth=self.depth)
+            if self.parent is not None:
+                Comment.objects.filter(id=self.parent_id).update(
+                    reply_count=models.F('reply_count') + 1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'parent', '-timestamp', '-id'],
+                         name='comment_thread_timestamp_idx'),
+            models.Index(fields=['post', 'path'],
+                         name='comment_post_path_idx'),
+        ]
+
+
+class CategoryQuerySet(models.QuerySet):
+    def recount(self):
+        rows = PostCategory.objects.filter(category=models.OuterRef('pk')).order_by().values('category')
+        return self.update(
+            post_count=Coalesce(models.Subquery(
+                rows.annotate(count=models.Count('pk')).values('count'),
+                output_field=models.IntegerField()), 0),
+            latest_post_at=models.Subquery(
+                rows.annotate(latest=models.Max('timestamp')).values('latest'),
+                output_field=models.DateTimeField()),
+        )
+
 
 class Category(models.Model):
-    title = models.CharField(max_length=20)
+    title = models.CharField(max_length=20, unique=True)
+    # denormalized from PostCategory, maintained in posts/signals.py
+    post_count = models.PositiveIntegerField(default=0, editable=False)
+    latest_post_at = models.DateTimeField(blank=True, null=True, editable=False)
+
+    objects = CategoryQuerySet.as_manager()
 
     def __str__(self):
         return self.title
@@ -70,35 +144,226 @@ class Category(models.Model):
         verbose_name_plural = 'Categories'
 
 
+def count_subquery(model):
+    rows = model.objects.filter(post=models.OuterRef('pk')).order_by()
+    return Coalesce(models.Subquery(
+        rows.values('post').annotate(count=models.Count('pk')).values('count'),
+        output_field=models.IntegerField()), 0)
+
+
+class PostQuerySet(models.QuerySet):
+    def for_api(self, content=True):
+        # everything PostSerializer reads, in a fixed number of queries
+        # (comments are loaded by posts.api.serializers.CommentPreviews)
+        queryset = self.select_related(
+            'author__user').prefetch_related('category')
+        if not content:
+            queryset = queryset.defer(*LONG_FIELDS)
+        return queryset
+
+    def adjust_count(self, field, delta):
+        # atomic in the database, safe under concurrent writes. The columns
+        # are unsigned on MySQL, so a decrement below 0 must never be
+        # computed, not just clamped afterwards
+        value = models.F(field) + delta
+        if delta < 0:
+            value = models.Case(
+                models.When(**{field + '__gte': -delta, 'then': value}),
+                default=models.Value(0), output_field=models.PositiveIntegerField())
+        return self.update(**{field: value})
+
+    def recount(self):
+        return self.update(
+            likes_count=count_subquery(Like),
+            views_count=count_subquery(PostView),
+            comments_count=count_subquery(Comment),
+        )
+
+
+# maintained by posts/links.py and with PostQuerySet.adjust_count, a full
+# Post.save of an existing post leaves them alone
+LINK_FIELDS = ['previous_post', 'next_post']
+COUNTER_FIELDS = ['likes_count', 'views_count', 'comments_count']
+
+
 class Post(models.Model):
     title = models.CharField(max_length=100)
     overview = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     author = models.ForeignKey('Author', on_delete=models.CASCADE)
     thumbnail = models.ImageField(blank=True, null=True)
-    category = models.ManyToManyField('Category')
+    # resized copies, see posts/images.py
+    thumbnail_variants = models.TextField(blank=True, default='', editable=False)
+    category = models.ManyToManyField('Category', through='PostCategory')
     featured = models.BooleanField(default=False)
     content = RichTextField()
+    # rendered from content on save, see posts/rendering.py
+    content_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
+    content_html = models.TextField(blank=True, default='', editable=False)
+    excerpt = models.TextField(blank=True, default='', editable=False)
+    word_count = models.PositiveIntegerField(default=0, editable=False)
+    reading_time = models.PositiveIntegerField(default=0, editable=False)
+    toc = models.TextField(blank=True, default='', editable=False)
+    # neighbours in the author's chain, maintained by posts/links.py
     previous_post = models.ForeignKey(
-        'self', related_name='previous', on_delete=models.SET_NULL, blank=True, null=True)
+        'self', related_name='previous', on_delete=models.SET_NULL, blank=True, null=True,
+        editable=False)
     next_post = models.ForeignKey(
-        'self', related_name='next', on_delete=models.SET_NULL, blank=True, null=True)
+        'self', related_name='next', on_delete=models.SET_NULL, blank=True, null=True,
+        editable=False)
+
+    # denormalized counts, maintained with PostQuerySet.adjust_count
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+    views_count = models.PositiveIntegerField(default=0, editable=False)
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = PostQuerySet.as_manager()
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields', None)
+        if update_fields is None:
+            render_post(self)
+        elif 'content' in update_fields and render_post(self):
+            kwargs['update_fields'] = list(update_fields) + RENDERED_FIELDS
+        if update_fields is None and not self._state.adding:
+            # an instance loaded before its links or counts last changed
+            # mustn't write the old ones back
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in LINK_FIELDS + COUNTER_FIELDS]
+        super().save(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-timestamp', '-id'],
+                         name='post_timestamp_idx'),
+            models.Index(fields=['featured', '-timestamp', '-id'],
+                         name='post_featured_timestamp_idx'),
+            models.Index(fields=['author', '-timestamp', '-id'],
+                         name='post_author_timestamp_idx'),
+        ]
+
     @property
     def comments(self):
         return self.comments.all().order_by('-timestamp')
 
     @property
     def likes(self):
-        return Like.objects.filter(post=self).count()
+        return self.likes_count
 
     @property
     def view_count(self):
-        return PostView.objects.filter(post=self).count()
+        return self.views_count
 
     @property
     def comment_count(self):
-        return Comment.objects.filter(post=self).count()
+        return self.comments_count
+
+
+class PostCategory(models.Model):
+    # the Post.category table, with the post's timestamp copied in so a
+    # category page is one range scan of post_category_timestamp_idx
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    timestamp = models.DateTimeField(blank=True, null=True, editable=False)
+
+    class Meta:
+        db_table = 'posts_post_category'
+        unique_together = [('post', 'category')]
+        indexes = [
+            models.Index(fields=['category', '-timestamp', '-post'],
+                         name='post_category_timestamp_idx'),
+        ]
+
+
+class PostSearch(models.Model):
+    # plain-text copy of a post for the full-text index, see posts/search.py
+    post = models.OneToOneField(
+        'Post', primary_key=True, on_delete=models.CASCADE)
+    title = models.CharField(max_length=100)
+    overview = models.TextField()
+    content = models.TextField()
+
+    def __str__(self):
+        return self.title
+
+
+class RelatedPost(models.Model):
+    # top related posts of each post, best first, written by the
+    # compute_related_posts command, see posts/recommendations.py
+    post = models.ForeignKey('Post', on_delete=models.CASCADE, related_name='+')
+    related = models.ForeignKey('Post', on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    def __str__(self):
+        return '{} -> {}'.format(self.post_id, self.related_id)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['post', 'rank'], name='unique_related_post_rank'),
+        ]
+
+
+class EngagementEvent(models.Model):
+    # append-only log written in batches by posts.buffers.engagement_events
+    # and aggregated into the rollup tables below by posts/engagement.py
+    VIEW = 1
+    LIKE = 2
+    UNLIKE = 3
+    COMMENT = 4
+    KINDS = [
+        (VIEW, 'view'),
+        (LIKE, 'like'),
+        (UNLIKE, 'unlike'),
+        (COMMENT, 'comment'),
+    ]
+
+    post = models.ForeignKey('Post', on_delete=models.CASCADE, related_name='+')
+    user = models.ForeignKey(User, on_delete=models.SET_NULL,
+                             blank=True, null=True, related_name='+')
+    kind = models.PositiveSmallIntegerField(choices=KINDS)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return '{} of post {}'.format(self.get_kind_display(), self.post_id)
+
+
+class EngagementRollup(models.Model):
+    # event counts of one post in one period starting at start (UTC)
+    post = models.ForeignKey('Post', on_delete=models.CASCADE, related_name='+')
+    start = models.DateTimeField()
+    views = models.PositiveIntegerField(default=0)
+    likes = models.PositiveIntegerField(default=0)
+    unlikes = models.PositiveIntegerField(default=0)
+    comments = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class HourlyEngagement(EngagementRollup):
+    class Meta:
+        # leads with start, trending reads a range of periods
+        constraints = [
+            models.UniqueConstraint(
+                fields=['start', 'post'], name='unique_hourly_engagement'),
+        ]
+
+
+class DailyEngagement(EngagementRollup):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['start', 'post'], name='unique_daily_engagement'),
+        ]
+
+
+class EngagementRollupState(models.Model):
+    # the last EngagementEvent already counted in the rollups, one row
+    last_event_id = models.BigIntegerField(default=0)
+    rolled_up_at = models.DateTimeField(blank=True, null=True)
@@ -0,0 +1,137 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Sum
+import heapq
+import math
+
+from .cache import response_cache, LIST_VERSION, RELATED_VERSION
+from .models import Post, PostCategory, PostView, RelatedPost
+
+# Related posts and per-user recommendations. compute_related() scores
+# each post against every post it shares a viewer with and the latest
+# RELATED_CATEGORY_CANDIDATES posts of each of its categories: the cosine
+# similarity of their viewers (PostView) plus
+# RELATED_CATEGORY_WEIGHT times the Jaccard overlap of their categories.
+# Scoring needs no database, so it runs on a pool of RELATED_POSTS_WORKERS
+# processes, and only the top RELATED_POSTS_COUNT of each post are kept
+# in RelatedPost. Reading them is one lookup on the (post, rank) index.
+
+_graph = None
+
+
+def invert(mapping):
+    inverted = {}
+    for key, values in mapping.items():
+        for value in values:
+            inverted.setdefault(value, set()).add(key)
+    return inverted
+
+
+class Graph:
+    def __init__(self, categories, category_posts, viewers, category_weight):
+        # {post: set of categories}, {category: candidate posts} and
+        # {post: set of users}
+        self.categories = categories
+        self.viewers = viewers
+        self.category_posts = category_posts
+        self.user_posts = invert(viewers)
+        self.category_weight = category_weight
+
+    def related(self, post, count):
+        # [(score, post)] of the count best related posts
+        viewers = self.viewers.get(post, set())
+        categories = self.categories.get(post, set())
+        co_views = Counter()
+        for user in viewers:
+            co_views.update(self.user_posts[user])
+        candidates = set(co_views)
+        for category in categories:
+            candidates.update(self.category_posts[category])
+        candidates.discard(post)
+
+        scored = []
+        for other in candidates:
+            score = 0.0
+            if co_views[other]:
+                score += co_views[other] / math.sqrt(len(viewers) * len(self.viewers[other]))
+            shared = categories & self.categories.get(other, set())
+            if shared:
+                score += self.category_weight * len(shared) / len(
+                    categories | self.categories[other])
+            scored.append((score, other))
+        return heapq.nlargest(count, scored)
+
+
+def load_graph():
+    categories, category_posts, viewers = {}, {}, {}
+    # every post of a large category would make scoring quadratic in its size
+    limit = getattr(settings, 'RELATED_CATEGORY_CANDIDATES', 200)
+    for post, category in PostCategory.objects.order_by(
+            'category', '-timestamp', '-post').values_list('post', 'category').iterator():
+        categories.setdefault(post, set()).add(category)
+        latest = category_posts.setdefault(category, [])
+        if len(latest) < limit:
+            latest.append(post)
+    for post, user in PostView.objects.values_list('post', 'user').iterator():
+        viewers.setdefault(post, set()).add(user)
+    return Graph(categories, category_posts, viewers,
+                 getattr(settings, 'RELATED_CATEGORY_WEIGHT', 0.5))
+
+
+def init_worker(graph):
+    global _graph
+    _graph = graph
+
+
+def score_posts(post_ids, count):
+    return [(post, _graph.related(post, count)) for post in post_ids]
+
+
+def chunked(items, size):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def save_related(results):
+    rows = [
+        RelatedPost(post_id=post, related_id=related, rank=rank, score=score)
+        for post, related_posts in results
+        for rank, (score, related) in enumerate(related_posts)
+    ]
+    with transaction.atomic():
+        RelatedPost.objects.filter(post__in=[post for post, related_posts in results]).delete()
+        RelatedPost.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
+
+
+def compute_related(count=None, workers=None, chunk_size=500):
+    # rebuilds RelatedPost, returns the number of rows written
+    count = count or getattr(settings, 'RELATED_POSTS_COUNT', 5)
+    workers = workers or getattr(settings, 'RELATED_POSTS_WORKERS', 4)
+    graph = load_graph()
+    chunks = chunked(list(Post.objects.order_by('id').values_list('id', flat=True)), chunk_size)
+
+    total = 0
+    if workers > 1 and len(chunks) > 1:
+        # the workers never query, but mustn't share the parent's sockets
+        connections.close_all()
+        with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(graph,)) as pool:
+            for results in pool.map(score_posts, chunks, [count] * len(chunks)):
+                total += save_related(results)
+    else:
+        init_worker(graph)
+        for chunk in chunks:
+            total += save_related(score_posts(chunk, count))
+    response_cache.bump(LIST_VERSION, RELATED_VERSION)
+    return total
+
+
+def recommended_posts(user):
+    # related posts of the user's latest views that they haven't read,
+    # {'related', 'score'} rows best first
+    seeds = list(PostView.objects.filter(user=user).order_by('-timestamp', '-id').values_list(
+        'post', flat=True)[:getattr(settings, 'RECOMMENDATION_SEED_POSTS', 10)])
+    return RelatedPost.objects.filter(post__in=seeds).exclude(
+        related__in=PostView.objects.filter(user=user).values('post')
+    ).values('related').annotate(score=Sum('score')).order_by('-score', '-related')
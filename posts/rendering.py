@@ -0,0 +1,169 @@
+from django.conf import settings
+from django.utils.text import Truncator, slugify
+from html.parser import HTMLParser
+from html import escape, unescape
+import hashlib
+import json
+import math
+import re
+
+# Everything derived from Post.content, worked out once when the post is
+# saved instead of on every read: the sanitized HTML, a plain-text
+# excerpt, the word count and reading time, and a table of contents
+# built from the headings. content_hash covers the content and
+# RENDER_VERSION, so unchanged posts are skipped and bumping the version
+# makes render_posts redo them all.
+
+RENDER_VERSION = 2
+
+RENDERED_FIELDS = ['content_hash', 'content_html', 'excerpt', 'word_count', 'reading_time', 'toc']
+# left out of the feed unless asked for, see PostQuerySet.for_api
+LONG_FIELDS = {'content', 'content_html', 'toc'}
+
+ALLOWED_TAGS = {
+    'a', 'abbr', 'b', 'blockquote', 'br', 'caption', 'code', 'div', 'em',
+    'figcaption', 'figure', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i',
+    'img', 'li', 'ol', 'p', 'pre', 's', 'span', 'strong', 'sub', 'sup',
+    'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'u', 'ul',
+}
+VOID_TAGS = {'br', 'hr', 'img'}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+    'img': {'src', 'alt', 'title', 'width', 'height'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan'},
+}
+URL_ATTRIBUTES = {'href', 'src'}
+ALLOWED_SCHEMES = {'http', 'https', 'mailto'}
+# dropped along with everything inside them
+DROPPED_TAGS = {'script', 'style', 'iframe', 'object', 'embed', 'template'}
+BLOCK_TAGS = ALLOWED_TAGS - {
+    'a', 'abbr', 'b', 'code', 'em', 'i', 'img', 's', 'span', 'strong', 'sub', 'sup', 'u'}
+TOC_TAGS = {'h2', 'h3'}
+
+# browsers ignore these anywhere in a URL, so "java\tscript:" is "javascript:"
+URL_IGNORED = re.compile(r'[\x00-\x20\x7f]+')
+# anything before the first ":" that isn't in a path, query or fragment
+SCHEME = re.compile(r'^([^/?#:]*):')
+WORD = re.compile(r'\w+', re.UNICODE)
+SPACE = re.compile(r'\s+')
+
+
+def content_hash(content):
+    data = '{}:{}'.format(RENDER_VERSION, content or '')
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def safe_url(value):
+    # relative URLs and ALLOWED_SCHEMES only
+    match = SCHEME.match(URL_IGNORED.sub('', unescape(value)))
+    return match is None or match.group(1).lower() in ALLOWED_SCHEMES
+
+
+class ContentParser(HTMLParser):
+    # rebuilds the HTML from allowed tags only, collecting the text and
+    # giving h2/h3 headings an id for the table of contents
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.html = []
+        self.text = []
+        self.toc = []
+        self.open_tags = []
+        self.dropping = 0
+        self.heading = None
+        self.slugs = set()
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+        if tag in BLOCK_TAGS:
+            self.text.append(' ')
+
+        allowed = ALLOWED_ATTRIBUTES.get(tag, set())
+        attributes = [(name, value or '') for name, value in attrs
+                      if name in allowed and (name not in URL_ATTRIBUTES or safe_url(value or ''))]
+        if tag in TOC_TAGS:
+            self.heading = {'level': int(tag[1]), 'index': len(self.html), 'text': []}
+
+        self.html.append('<{}{}>'.format(tag, ''.join(
+            ' {}="{}"'.format(name, escape(value)) for name, value in attributes)))
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+            return
+        if self.dropping or tag not in self.open_tags:
+            return
+        # close anything left open inside this tag
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.html.append('</{}>'.format(open_tag))
+            if open_tag in TOC_TAGS and self.heading is not None:
+                self.add_heading()
+            if open_tag == tag:
+                break
+        if tag in BLOCK_TAGS:
+            self.text.append(' ')
+
+    def handle_data(self, data):
+        if self.dropping:
+            return
+        self.html.append(escape(data, quote=False))
+        self.text.append(data)
+        if self.heading is not None:
+            self.heading['text'].append(data)
+
+    def add_heading(self):
+        title = SPACE.sub(' ', ''.join(self.heading['text'])).strip()
+        if title:
+            slug = base = slugify(title) or 'section'
+            number = 1
+            while slug in self.slugs:
+                number += 1
+                slug = '{}-{}'.format(base, number)
+            self.slugs.add(slug)
+            index = self.heading['index']
+            self.html[index] = self.html[index][:-1] + ' id="{}">'.format(slug)
+            self.toc.append({'level': self.heading['level'], 'id': slug, 'title': title})
+        self.heading = None
+
+    def close(self):
+        super().close()
+        while self.open_tags:
+            self.handle_endtag(self.open_tags[-1])
+
+
+def render(content):
+    parser = ContentParser()
+    parser.feed(content or '')
+    parser.close()
+
+    text = SPACE.sub(' ', ''.join(parser.text)).strip()
+    word_count = len(WORD.findall(text))
+    return {
+        'content_hash': content_hash(content),
+        'content_html': ''.join(parser.html),
+        'excerpt': Truncator(text).chars(settings.POST_EXCERPT_LENGTH),
+        'word_count': word_count,
+        'reading_time': max(1, math.ceil(word_count / settings.WORDS_PER_MINUTE)),
+        'toc': json.dumps(parser.toc),
+    }
+
+
+def render_post(post, force=False):
+    # sets the rendered fields on post, returns whether anything changed
+    if not force and post.content_hash == content_hash(post.content):
+        return False
+    for field, value in render(post.content).items():
+        setattr(post, field, value)
+    return True
+
+
+def load_toc(value):
+    return json.loads(value) if value else []
@@ -0,0 +1,131 @@
+from django.db import connection
+from django.db.models import Q, FloatField, Value
+from django.db.models.expressions import RawSQL
+from django.utils.html import strip_tags
+import html
+import re
+
+# Full-text search over post title, overview and content. The text is kept
+# in the PostSearch table, and each database indexes it with its own
+# engine: an FTS5 table kept in sync by triggers on SQLite, a FULLTEXT
+# index on MySQL (both created in migration 0003). Other databases fall
+# back to LIKE queries. search_posts() is the only entry point the views
+# need.
+
+TERM = re.compile(r'\w+', re.UNICODE)
+
+
+def get_terms(query):
+    return TERM.findall(query.lower())
+
+
+def html_to_text(content):
+    return html.unescape(strip_tags(content or ''))
+
+
+def search_document(post):
+    from posts.models import PostSearch
+
+    return PostSearch(
+        post_id=post.id,
+        title=post.title,
+        overview=post.overview,
+        content=html_to_text(post.content),
+    )
+
+
+def index_post(post):
+    document = search_document(post)
+    document.save()
+
+
+def index_posts(posts, batch_size=500):
+    from posts.models import PostSearch
+
+    documents = [search_document(post) for post in posts]
+    PostSearch.objects.filter(post_id__in=[document.post_id for document in documents]).delete()
+    PostSearch.objects.bulk_create(documents, batch_size=batch_size)
+
+
+class SQLiteSearch:
+    # bm25 weights for title, overview and content
+    rank_sql = (
+        'SELECT bm25(posts_postsearch_fts, 10.0, 5.0, 1.0) FROM posts_postsearch_fts '
+        'WHERE posts_postsearch_fts MATCH %s AND rowid = posts_post.id'
+    )
+    match_sql = (
+        'posts_post.id IN (SELECT rowid FROM posts_postsearch_fts '
+        'WHERE posts_postsearch_fts MATCH %s)'
+    )
+
+    def filter(self, queryset, terms):
+        # every term, each as a prefix
+        match = ' '.join('"{}"*'.format(term) for term in terms)
+        # extra() because an id__in=RawSQL(...) filter would be wrapped in
+        # a second pair of parentheses, which SQLite reads as a scalar
+        return queryset.extra(where=[self.match_sql], params=[match]).annotate(
+            rank=RawSQL(self.rank_sql, [match], output_field=FloatField())
+        ).order_by('rank', '-id')
+
+
+class MySQLSearch:
+    rank_sql = (
+        'SELECT MATCH(title, overview, content) AGAINST (%s IN BOOLEAN MODE) '
+        'FROM posts_postsearch WHERE post_id = posts_post.id'
+    )
+    match_sql = (
+        'posts_post.id IN (SELECT post_id FROM posts_postsearch '
+        'WHERE MATCH(title, overview, content) AGAINST (%s IN BOOLEAN MODE))'
+    )
+
+    def filter(self, queryset, terms):
+        match = ' '.join('+{}*'.format(term) for term in terms)
+        return queryset.extra(where=[self.match_sql], params=[match]).annotate(
+            rank=RawSQL(self.rank_sql, [match], output_field=FloatField())
+        ).order_by('-rank', '-id')
+
+
+class FallbackSearch:
+    def filter(self, queryset, terms):
+        for term in terms:
+            queryset = queryset.filter(
+                Q(postsearch__title__icontains=term) |
+                Q(postsearch__overview__icontains=term) |
+                Q(postsearch__content__icontains=term))
+        return queryset.annotate(
+            rank=Value(0.0, output_field=FloatField())).order_by('-timestamp', '-id')
+
+
+def get_backend():
+    if connection.vendor == 'sqlite':
+        return SQLiteSearch()
+    if connection.vendor == 'mysql':
+        return MySQLSearch()
+    return FallbackSearch()
+
+
+def search_posts(queryset, query):
+    # queryset filtered to posts matching every term of query, best first
+    terms = get_terms(query)
+    if not terms:
+        return queryset.none()
+    return get_backend().filter(queryset, terms)
+
+
+def rebuild_index(batch_size=500):
+    from posts.models import Post, PostSearch
+
+    PostSearch.objects.all().delete()
+    posts = Post.objects.only('id', 'title', 'overview', 'content').order_by('id')
+    batch = []
+    for post in posts.iterator(chunk_size=batch_size):
+        batch.append(search_document(post))
+        if len(batch) >= batch_size:
+            PostSearch.objects.bulk_create(batch)
+            batch = []
+    PostSearch.objects.bulk_create(batch)
+
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO posts_postsearch_fts(posts_postsearch_fts) VALUES ('rebuild')")
@@ -1,9 +1,18 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save, m2m_changed
 from django.dispatch import receiver
 # from django.contrib.auth.models import User
 from django.conf import settings
 
-from .models import UserProfile
+from .buffers import engagement_events
+from .cache import response_cache, post_version, LIST_VERSION, CATEGORY_VERSION, CATEGORY_INDEX_VERSION
+from .images import needs_variants, schedule
+from .links import linked_posts, per_category, relink, update_links
+from .models import (
+    UserProfile, Author, Post, PostCategory, Comment, Like, Category, EngagementEvent
+)
+from .search import index_post
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
@@ -15,3 +24,186 @@ def create_user_profile(sender, instance, created, **kwargs):
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def save_user_profile(sender, instance, **kwargs):
     instance.userprofile.save()
+
+
+# response cache invalidation, after the write has been committed
+
+def invalidate_posts(*post_ids):
+    versions = [LIST_VERSION] + [post_version(post_id) for post_id in post_ids]
+    transaction.on_commit(lambda: response_cache.bump(*versions))
+
+
+@receiver(post_save, sender=Post)
+@receiver(pre_delete, sender=Post)
+def invalidate_post(sender, instance, **kwargs):
+    # neighbours embed this post's title and thumbnail
+    neighbour_ids = Post.objects.filter(
+        Q(previous_post=instance.id) | Q(next_post=instance.id)
+    ).values_list('id', flat=True)
+    invalidate_posts(instance.id, *neighbour_ids)
+
+
+@receiver(m2m_changed, sender=Post.category.through)
+def invalidate_post_categories(sender, instance, action, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if isinstance(instance, Post):
+        invalidate_posts(instance.id)
+    else:
+        invalidate_posts(*(pk_set or ()))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+def invalidate_post_engagement(sender, instance, **kwargs):
+    invalidate_posts(instance.post_id)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category(sender, instance, **kwargs):
+    transaction.on_commit(
+        lambda: response_cache.bump(LIST_VERSION, CATEGORY_VERSION))
+
+
+# category index, see Category.post_count and PostCategory.timestamp
+
+def recount_categories(category_ids):
+    Category.objects.filter(id__in=category_ids).recount()
+    transaction.on_commit(lambda: response_cache.bump(CATEGORY_INDEX_VERSION))
+
+
+@receiver(m2m_changed, sender=Post.category.through)
+def update_category_index(sender, instance, action, pk_set, **kwargs):
+    forward = isinstance(instance, Post)
+    if action == 'pre_clear':
+        # the rows are gone by post_clear
+        related = instance.category if forward else instance.post_set
+        instance._cleared_ids = set(related.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    related_ids = pk_set if pk_set is not None else getattr(instance, '_cleared_ids', set())
+    post_ids, category_ids = ([instance.id], related_ids) if forward else (related_ids, [instance.id])
+    if action == 'post_add':
+        PostCategory.objects.filter(post_id__in=post_ids, category_id__in=category_ids).update(
+            timestamp=Subquery(Post.objects.filter(id=OuterRef('post_id')).values('timestamp')[:1]))
+    recount_categories(category_ids)
+
+
+@receiver(pre_delete, sender=Post)
+def remember_post_categories(sender, instance, **kwargs):
+    # the PostCategory rows are deleted without m2m_changed
+    instance._category_ids = list(
+        PostCategory.objects.filter(post=instance).values_list('category_id', flat=True))
+
+
+@receiver(post_delete, sender=Post)
+def update_deleted_post_categories(sender, instance, **kwargs):
+    recount_categories(getattr(instance, '_category_ids', []))
+
+
+@receiver(post_save, sender=Post)
+def update_post_category_timestamps(sender, instance, created, **kwargs):
+    # set by remember_post_position()
+    if getattr(instance, '_timestamp_changed', False):
+        rows = PostCategory.objects.filter(post=instance)
+        rows.update(timestamp=instance.timestamp)
+        recount_categories(list(rows.values_list('category_id', flat=True)))
+
+
+# engagement log, see posts/engagement.py. Views are recorded by
+# PostDetailView, events of posts deleted meanwhile are dropped.
+
+def record_engagement(kind, instance):
+    post_id, user_id = instance.post_id, instance.user_id
+    transaction.on_commit(lambda: engagement_events.record(kind, post_id, user_id))
+
+
+@receiver(post_save, sender=Like)
+def record_like(sender, instance, created, **kwargs):
+    if created:
+        record_engagement(EngagementEvent.LIKE, instance)
+
+
+@receiver(post_delete, sender=Like)
+def record_unlike(sender, instance, **kwargs):
+    record_engagement(EngagementEvent.UNLIKE, instance)
+
+
+@receiver(post_save, sender=Comment)
+def record_comment(sender, instance, created, **kwargs):
+    if created:
+        record_engagement(EngagementEvent.COMMENT, instance)
+
+
+# previous/next links, see posts/links.py
+
+@receiver(pre_save, sender=Post)
+def remember_post_position(sender, instance, update_fields=None, **kwargs):
+    instance._linked_posts = None
+    instance._timestamp_changed = False
+    if instance.pk is None:
+        return
+    if update_fields is not None and not {'author', 'timestamp'} & set(update_fields):
+        return
+    old = Post.objects.filter(id=instance.pk).values_list('author_id', 'timestamp').first()
+    if old is not None and old != (instance.author_id, instance.timestamp):
+        instance._linked_posts = linked_posts(instance.pk)
+        # the category index orders by the timestamp too
+        instance._timestamp_changed = old[1] != instance.timestamp
+
+
+@receiver(post_save, sender=Post)
+def update_post_links(sender, instance, created, **kwargs):
+    if created:
+        update_links(instance.id)
+    elif getattr(instance, '_linked_posts', None) is not None:
+        update_links(instance.id, instance._linked_posts)
+
+
+@receiver(m2m_changed, sender=Post.category.through)
+def update_category_links(sender, instance, action, pk_set, **kwargs):
+    if not per_category() or action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if isinstance(instance, Post):
+        post_ids = [instance.id]
+    else:
+        post_ids = pk_set if pk_set is not None else getattr(instance, '_cleared_ids', set())
+    for post_id in post_ids:
+        # the stored links are still the ones from the old category
+        update_links(post_id, linked_posts(post_id))
+
+
+@receiver(pre_delete, sender=Post)
+def remember_post_neighbours(sender, instance, **kwargs):
+    instance._linked_posts = linked_posts(instance.id) - {instance.id}
+
+
+@receiver(post_delete, sender=Post)
+def relink_post_neighbours(sender, instance, **kwargs):
+    relink(getattr(instance, '_linked_posts', ()))
+
+
+# full-text index, deletes cascade to PostSearch
+
+@receiver(post_save, sender=Post)
+def update_search_index(sender, instance, **kwargs):
+    index_post(instance)
+
+
+# resized image variants, made off the request thread
+
+@receiver(post_save, sender=Post)
+def make_thumbnail_variants(sender, instance, **kwargs):
+    if needs_variants(instance, 'thumbnail'):
+        schedule(instance, 'thumbnail')
+
+
+@receiver(post_save, sender=Author)
+def make_profile_image_variants(sender, instance, **kwargs):
+    if needs_variants(instance, 'profile_image'):
+        schedule(instance, 'profile_image')
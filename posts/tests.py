@@ -1,3 +1,1233 @@
-from django.test import TestCase
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.wsgi import get_wsgi_application
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase, APITransactionTestCase
+from io import BytesIO, StringIO
+from unittest import mock
+from PIL import Image
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import rsa
+import asyncio
+import json
+import jwt
+import os
+import shutil
+import tempfile
+import time
 
-# Create your tests here.
+from posts.api import urls
+from posts.api.fast import (
+    FastPostSerializer, FastPostSummarySerializer, FastCategorySerializer, FastCommentSerializer,
+    FastUserProfileSerializer
+)
+from posts.api.serializers import (
+    PostSerializer, PostSummarySerializer, CategorySerializer, CommentSerializer, UserProfileSerializer
+)
+from posts.metrics import request_metrics
+from posts.models import (
+    Author, Category, Comment, DailyEngagement, EngagementEvent, HourlyEngagement, Like, Post,
+    PostSearch, PostView, RelatedPost
+)
+from posts.asgi import ReadPathApplication
+from posts.links import relink_chains
+from posts.rendering import render
+from posts.buffers import PostViewBuffer, engagement_events, insert_views, post_view_buffer
+from posts.management.commands.explain_queries import find_full_scans
+from posts.cache import response_cache
+from posts.engagement import roll_up
+from posts.utils import jwks_store, jwt_decode_token, token_cache
+
+User = get_user_model()
+
+# Every test writes views and engagement events during the request: the
+# buffers' writer threads would write outside the test transactions and
+# flush at exit after the test database is gone
+sync_buffers = override_settings(POST_VIEW_SYNC=True, ENGAGEMENT_EVENTS_SYNC=True)
+
+
+def setUpModule():
+    sync_buffers.enable()
+
+
+def tearDownModule():
+    sync_buffers.disable()
+
+
+def make_signing_key(kid):
+    private_key = rsa.generate_private_key(
+        public_exponent=65537, key_size=2048, backend=default_backend())
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(
+        private_key.public_key()))
+    jwk['kid'] = kid
+    return private_key, jwk
+
+
+def make_token(private_key, kid, **claims):
+    payload = {
+        'sub': 'auth0|tester',
+        'aud': settings.JWT_AUTH['JWT_AUDIENCE'],
+        'iss': settings.JWT_AUTH['JWT_ISSUER'],
+        'exp': int(time.time()) + 600,
+        'scope': 'read:posts',
+    }
+    payload.update(claims)
+    return jwt.encode(payload, private_key, algorithm='RS256',
+                      headers={'kid': kid}).decode('utf-8')
+
+
+class SignedTokenTestCase(TestCase):
+    # Serves a freshly generated signing key from a local JWKS file
+
+    def setUp(self):
+        self.private_key, jwk = make_signing_key('key-1')
+        self.jwks_file = tempfile.NamedTemporaryFile('w', suffix='.json')
+        self.write_jwks([jwk])
+        self.settings_override = override_settings(
+            JWKS_PATH=self.jwks_file.name, JWKS_MIN_REFRESH_INTERVAL=0)
+        self.settings_override.enable()
+        jwks_store.clear()
+        token_cache.clear()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.jwks_file.close()
+        jwks_store.clear()
+        token_cache.clear()
+
+    def write_jwks(self, keys):
+        self.jwks_file.seek(0)
+        self.jwks_file.truncate()
+        json.dump({'keys': keys}, self.jwks_file)
+        self.jwks_file.flush()
+
+
+class JWKSKeyStoreTest(SignedTokenTestCase):
+    def test_keys_are_loaded_once(self):
+        token = make_token(self.private_key, 'key-1')
+        with mock.patch.object(jwks_store, '_load', wraps=jwks_store._load) as load:
+            jwt_decode_token(token)
+            jwt_decode_token(token)
+        self.assertEqual(load.call_count, 1)
+
+    def test_unknown_kid_refreshes_once(self):
+        jwt_decode_token(make_token(self.private_key, 'key-1'))
+
+        rotated_key, jwk = make_signing_key('key-2')
+        self.write_jwks([jwk])
+        with mock.patch.object(jwks_store, '_load', wraps=jwks_store._load) as load:
+            payload = jwt_decode_token(make_token(rotated_key, 'key-2'))
+            with self.assertRaises(Exception):
+                jwt_decode_token(make_token(self.private_key, 'key-3'))
+        self.assertEqual(payload['sub'], 'auth0|tester')
+        self.assertEqual(load.call_count, 2)
+
+
+class VerifiedTokenCacheTest(SignedTokenTestCase):
+    def test_repeated_token_is_verified_once(self):
+        token = make_token(self.private_key, 'key-1')
+        with mock.patch('posts.utils.jwt.decode', wraps=jwt.decode) as decode:
+            first = jwt_decode_token(token)
+            second = jwt_decode_token(token)
+        self.assertEqual(first, second)
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual(token_cache.stats()['hits'], 1)
+        self.assertEqual(token_cache.stats()['misses'], 1)
+
+    def test_expired_entry_is_evicted(self):
+        token = make_token(self.private_key, 'key-1')
+        claims = jwt_decode_token(token)
+        token_cache.set(token, dict(claims, exp=int(time.time()) - 1))
+        self.assertIsNone(token_cache.get(token))
+        self.assertEqual(token_cache.stats()['size'], 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        with override_settings(JWT_TOKEN_CACHE_SIZE=2):
+            tokens = [make_token(self.private_key, 'key-1', sub=str(i))
+                      for i in range(3)]
+            for token in tokens:
+                jwt_decode_token(token)
+            self.assertIsNone(token_cache.get(tokens[0]))
+            self.assertIsNotNone(token_cache.get(tokens[2]))
+
+
+def make_chain(author, length):
+    # oldest first, linked by posts/links.py
+    posts = [Post.objects.create(title='Post {}'.format(i), overview='overview',
+                                 content='content', author=author)
+             for i in range(length)]
+    for post in posts:
+        post.refresh_from_db()
+    return posts
+
+
+class PostLinkTest(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='author')
+        self.author = Author.objects.create(user=user)
+
+    def test_neighbours_are_compact(self):
+        posts = make_chain(self.author, 3)
+        data = PostSerializer(posts[1]).data
+        self.assertEqual(data['previous_post']['id'], posts[0].id)
+        self.assertEqual(data['next_post']['id'], posts[2].id)
+        self.assertEqual(set(data['next_post']),
+                         {'id', 'title', 'thumbnail', 'timestamp'})
+
+    def test_detail_cost_does_not_grow_with_chain(self):
+        short, long = make_chain(self.author, 3), make_chain(self.author, 30)
+        with CaptureQueriesContext(connection) as short_queries:
+            PostSerializer(Post.objects.get(id=short[1].id)).data
+        with self.assertNumQueries(len(short_queries)):
+            PostSerializer(Post.objects.get(id=long[15].id)).data
+
+    def test_depth_is_configurable(self):
+        posts = make_chain(self.author, 5)
+        data = PostSerializer(
+            posts[2], context={'post_link_depth': 2}).data
+        self.assertEqual(data['next_post']['next_post']['id'], posts[4].id)
+        self.assertNotIn('next_post', data['next_post']['next_post'])
+
+
+class PostsAPITestCase(APITestCase):
+    def setUp(self):
+        # versions are bumped on commit, which never happens in a TestCase
+        response_cache.cache.clear()
+        self.user = User.objects.create(username='author')
+        self.author = Author.objects.create(user=self.user)
+
+
+class PostsViewQueryTest(PostsAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(title='django')
+
+    def add_posts(self, count):
+        for post in make_chain(self.author, count):
+            post.category.add(self.category)
+            Comment.objects.create(user=self.user, post=post, content='hi')
+            Like.objects.create(user=self.user, post=post)
+            PostView.objects.create(user=self.user, post=post)
+        Post.objects.recount()
+
+    def test_list_query_count_is_constant(self):
+        self.add_posts(2)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/posts/?expand=comments,previous_post,next_post')
+
+        self.add_posts(10)
+        # posts, categories, the comment page cutoffs, comments and the
+        # previous/next links
+        self.assertEqual(len(queries), 5)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get('/api/posts/?page_size=12&expand=comments,previous_post,next_post')
+        self.assertEqual(len(response.data['results']), 12)
+        self.assertEqual(response.data['results'][0]['likes'], 1)
+        self.assertEqual(response.data['results'][0]['view_count'], 1)
+        self.assertEqual(response.data['results'][0]['comment_count'], 1)
+
+    def test_summary_skips_heavy_fields(self):
+        self.add_posts(3)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/posts/')
+        post = response.data['results'][0]
+        self.assertNotIn('content', post)
+        self.assertNotIn('comments', post)
+        self.assertEqual(post['comment_count'], 1)
+        # posts and categories only
+        self.assertEqual(len(queries), 2)
+
+    def test_fields_and_expand(self):
+        self.add_posts(1)
+        response = self.client.get('/api/posts/?expand=content')
+        self.assertIn('content', response.data['results'][0])
+
+        response = self.client.get('/api/posts/?fields=id,title')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title'})
+
+
+class CursorPaginationTest(PostsAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.posts = make_chain(self.author, 5)
+
+    def collect(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_posts_are_paged_newest_first(self):
+        ids = self.collect('/api/posts/?page_size=2')
+        self.assertEqual(ids, [post.id for post in reversed(self.posts)])
+
+    def test_posts_filter_by_featured_and_category(self):
+        category = Category.objects.create(title='django')
+        self.posts[1].category.add(category)
+        self.posts[3].category.add(category)
+        Post.objects.filter(id=self.posts[3].id).update(featured=True)
+
+        self.assertEqual(self.collect('/api/posts/?category=django'),
+                         [self.posts[3].id, self.posts[1].id])
+        self.assertEqual(self.collect('/api/posts/?featured=true'),
+                         [self.posts[3].id])
+
+    def test_comments_are_paged(self):
+        post = self.posts[0]
+        comments = [Comment.objects.create(user=self.user, post=post, content=str(i))
+                    for i in range(5)]
+        ids = self.collect('/api/posts/{}/comments/?page_size=2'.format(post.id))
+        self.assertEqual(ids, [comment.id for comment in reversed(comments)])
+
+
+class EmbeddedCommentsTest(PostsAPITestCase):
+    def test_detail_embeds_the_first_page(self):
+        post = make_chain(self.author, 1)[0]
+        comments = [Comment.objects.create(user=self.user, post=post, content=str(i))
+                    for i in range(settings.COMMENTS_PAGE_SIZE + 5)]
+        Comment.objects.create(user=self.user, post=post, content='reply', parent=comments[-1])
+
+        response = self.client.get('/api/posts/{}/'.format(post.id))
+        ids = [comment['id'] for comment in response.data['comments']]
+        self.assertEqual(ids, [comment.id for comment in reversed(comments)][:settings.COMMENTS_PAGE_SIZE])
+
+        response = self.client.get(response.data['comments_next'])
+        self.assertEqual([comment['id'] for comment in response.data['results']],
+                         [comment.id for comment in reversed(comments[:5])])
+
+        response = self.client.get('/api/posts/?expand=comments')
+        self.assertEqual(len(response.data['results'][0]['comments']), settings.COMMENTS_PAGE_SIZE)
+        self.assertIsNotNone(response.data['results'][0]['comments_next'])
+
+
+class PostCountTest(PostsAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = make_chain(self.author, 1)[0]
+        self.client.force_authenticate(self.user)
+
+    def test_writes_update_counts(self):
+        self.client.post('/api/posts/{}/comments/'.format(self.post.id),
+                         {'comment': 'hi', 'blogId': self.post.id})
+        self.client.get('/api/posts/{}/'.format(self.post.id))
+        self.client.get('/api/posts/{}/'.format(self.post.id))
+        response = self.client.get('/api/posts/{}/'.format(self.post.id))
+        self.assertEqual(response.data['comment_count'], 1)
+        self.assertEqual(response.data['view_count'], 1)
+
+    def test_stale_save_keeps_counts(self):
+        Post.objects.filter(id=self.post.id).adjust_count('likes_count', 1)
+        self.post.title = 'renamed'
+        self.post.save()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.title, self.post.likes), ('renamed', 1))
+
+    def test_counts_never_go_below_zero(self):
+        posts = Post.objects.filter(id=self.post.id)
+        posts.adjust_count('likes_count', 2)
+        posts.adjust_count('likes_count', -1)
+        self.assertEqual(posts.get().likes, 1)
+        posts.adjust_count('likes_count', -3)
+        self.assertEqual(posts.get().likes, 0)
+        posts.adjust_count('likes_count', -1)
+        self.assertEqual(posts.get().likes, 0)
+
+    def test_recount_command(self):
+        Like.objects.create(user=self.user, post=self.post)
+        with self.assertRaises(CommandError):
+            call_command('recount_posts', '--check', stdout=StringIO())
+
+        call_command('recount_posts', stdout=StringIO())
+        call_command('recount_posts', '--check', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes, 1)
+
+
+class PostViewBufferTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='author')
+        self.post = make_chain(Author.objects.create(user=self.user), 1)[0]
+
+    @override_settings(POST_VIEW_SYNC=False)
+    def test_views_are_written_on_flush(self):
+        buffer = PostViewBuffer()
+        with mock.patch.object(buffer, '_start'):
+            buffer.record(self.user.id, self.post.id)
+            buffer.record(self.user.id, self.post.id)
+            self.assertFalse(PostView.objects.exists())
+            buffer.flush()
+
+        self.assertEqual(PostView.objects.count(), 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.view_count, 1)
+
+    def test_large_batches(self):
+        User.objects.bulk_create([User(username='reader-{}'.format(i)) for i in range(1500)])
+        views = {(user_id, self.post.id) for user_id in
+                 User.objects.filter(username__startswith='reader-').values_list('id', flat=True)}
+        PostView.objects.create(user_id=min(views)[0], post=self.post,
+                                timestamp=timezone.now() - timedelta(days=1))
+        Post.objects.filter(id=self.post.id).update(views_count=1)
+        PostViewBuffer.write(views)
+        PostViewBuffer.write(views)
+        self.assertEqual(PostView.objects.count(), 1500)
+        self.assertFalse(PostView.objects.filter(timestamp__lt=timezone.now() - timedelta(hours=1)).exists())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.view_count, 1500)
+
+    @override_settings(POST_VIEW_SYNC=False)
+    def test_views_of_deleted_posts_are_dropped(self):
+        other = make_chain(self.post.author, 1)[0]
+        buffer = PostViewBuffer()
+        with mock.patch.object(buffer, '_start'):
+            buffer.record(self.user.id, self.post.id)
+            buffer.record(self.user.id, other.id)
+            other.delete()
+            buffer.flush()
+        self.assertEqual(list(PostView.objects.values_list('post', flat=True)), [self.post.id])
+
+    def test_deleting_a_post_is_not_a_view(self):
+        self.client.force_login(self.user)
+        with mock.patch.object(post_view_buffer, 'record') as record:
+            response = self.client.delete('/api/posts/{}/'.format(self.post.id))
+        self.assertEqual(response.status_code, 204)
+        record.assert_not_called()
+
+    def test_existing_views_are_ignored(self):
+        PostView.objects.create(user=self.user, post=self.post)
+        PostViewBuffer.write({(self.user.id, self.post.id)})
+        self.assertEqual(PostView.objects.count(), 1)
+
+    def test_repeat_views_keep_the_cache(self):
+        PostViewBuffer.write({(self.user.id, self.post.id)})
+        with mock.patch.object(response_cache, 'bump') as bump:
+            PostViewBuffer.write({(self.user.id, self.post.id)})
+        bump.assert_not_called()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.view_count, 1)
+
+    def test_views_written_meanwhile_are_not_counted(self):
+        reader = User.objects.create(username='reader')
+        views = [PostView(user=self.user, post=self.post), PostView(user=reader, post=self.post)]
+        # another process wrote the reader's view after write() looked it up
+        PostView.objects.create(user=reader, post=self.post)
+        self.assertEqual([view.user_id for view in insert_views(views)], [self.user.id])
+        self.assertEqual(PostView.objects.count(), 2)
+
+
+class ResponseCacheTest(APITransactionTestCase):
+    def setUp(self):
+        response_cache.cache.clear()
+        response_cache.clear_stats()
+        self.user = User.objects.create(username='author')
+        self.post = make_chain(Author.objects.create(user=self.user), 1)[0]
+        self.url = '/api/posts/{}/'.format(self.post.id)
+
+    def test_detail_is_served_from_cache(self):
+        self.client.get(self.url)
+        # the view is still logged, but nothing is read
+        with mock.patch.object(engagement_events, 'record'), self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['id'], self.post.id)
+        self.assertEqual(response_cache.stats()['post-detail']['hit_ratio'], 0.5)
+
+    @override_settings(ALLOWED_HOSTS=['internal', 'testserver'])
+    def test_hosts_are_cached_apart(self):
+        make_chain(self.post.author, 1)
+        url = '/api/posts/?page_size=1'
+        self.client.get(url, HTTP_HOST='internal')
+        response = self.client.get(url)
+        self.assertEqual(response_cache.stats()['posts']['hits'], 0)
+        self.assertTrue(response.data['next'].startswith('http://testserver/'))
+
+    def test_etag_returns_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_writes_invalidate_cached_responses(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.get('/api/posts/?expand=comments')
+
+        Comment.objects.create(user=self.user, post=self.post, content='hi')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['comments']), 1)
+        response = self.client.get('/api/posts/?expand=comments')
+        self.assertEqual(len(response.data['results'][0]['comments']), 1)
+
+
+class FastSerializerParityTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='author')
+        author = Author.objects.create(user=self.user, profile_image='me.png')
+        category = Category.objects.create(title='django')
+        self.posts = make_chain(author, 3)
+        for post in self.posts:
+            post.thumbnail = 'thumb.png'
+            post.save()
+            post.category.add(category)
+            Comment.objects.create(user=self.user, post=post, content='hi')
+            PostView.objects.create(user=self.user, post=post)
+        Post.objects.recount()
+        RelatedPost.objects.create(post=self.posts[0], related=self.posts[2], rank=0, score=1.0)
+        RelatedPost.objects.create(post=self.posts[0], related=self.posts[1], rank=1, score=0.5)
+
+    def request(self, path='/api/posts/'):
+        return Request(APIRequestFactory().get(path))
+
+    def assertSameOutput(self, serializer_class, fast_serializer_class, instance, **kwargs):
+        expected = serializer_class(instance, **kwargs).data
+        actual = fast_serializer_class(instance, **kwargs).data
+        self.assertEqual(json.loads(json.dumps(expected)), actual)
+
+    def test_posts(self):
+        posts = Post.objects.for_api()
+        for context in [{}, {'request': self.request()}, {'post_link_depth': 2}]:
+            self.assertSameOutput(
+                PostSerializer, FastPostSerializer, posts, many=True, context=context)
+            self.assertSameOutput(
+                PostSerializer, FastPostSerializer, posts[0], context=context)
+
+    def test_post_summaries(self):
+        for path in ['/api/posts/', '/api/posts/?expand=content,next_post,related_posts',
+                     '/api/posts/?fields=id']:
+            self.assertSameOutput(
+                PostSummarySerializer, FastPostSummarySerializer, Post.objects.for_api(),
+                many=True, context={'request': self.request(path)})
+
+    def test_comments_categories_and_profiles(self):
+        self.assertSameOutput(
+            CommentSerializer, FastCommentSerializer, Comment.objects.all(), many=True)
+        self.assertSameOutput(
+            CategorySerializer, FastCategorySerializer, Category.objects.all(), many=True)
+        self.assertSameOutput(
+            UserProfileSerializer, FastUserProfileSerializer, self.user.userprofile)
+        self.assertSameOutput(
+            UserProfileSerializer, FastUserProfileSerializer, self.user.userprofile,
+            context={'request': self.request('/api/users/1/profile/')})
+
+
+class UserProfileViewTest(PostsAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+        self.url = '/api/users/{}/profile/'.format(self.user.userprofile.id)
+
+    def add_history(self, count):
+        for post in make_chain(self.author, count):
+            PostView.objects.create(user=self.user, post=post)
+
+    @override_settings(FAST_SERIALIZERS=False)
+    def test_query_count_does_not_grow_with_history(self):
+        self.add_history(2)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+
+        self.add_history(20)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data['reading_list']['results']), 10)
+        self.assertEqual(len(response.data['my_posts']['results']), 10)
+
+    def test_reading_list_is_paged_by_recency(self):
+        self.add_history(12)
+        oldest = PostView.objects.order_by('timestamp', 'id').first()
+        PostView.objects.filter(id=oldest.id).update(timestamp=timezone.now())
+
+        response = self.client.get(self.url)
+        reading_list = response.data['reading_list']
+        self.assertEqual(reading_list['results'][0]['id'], oldest.id)
+        self.assertEqual(set(reading_list['results'][0]['post']),
+                         {'id', 'title', 'thumbnail', 'timestamp'})
+
+        response = self.client.get(reading_list['next'])
+        self.assertEqual(len(response.data['reading_list']['results']), 2)
+        self.assertEqual(len(response.data['my_posts']['results']), 10)
+
+
+class PostWriteTest(PostsAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+        Category.objects.create(title='django')
+        Category.objects.create(title='react')
+
+    def form(self, **extra):
+        data = {
+            'formData': {'title': 'title', 'overview': 'overview',
+                         'content': 'content', 'thumbnail': None},
+            'selectedCategories': ['django', 'react'],
+        }
+        data.update(extra)
+        return data
+
+    def test_create_resolves_categories_in_one_query(self):
+        response = self.client.post('/api/posts/', self.form(), format='json')
+        post = Post.objects.get(id=response.data['id'])
+        self.assertEqual(post.category.count(), 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/api/posts/', self.form(), format='json')
+        category_queries = [query for query in queries
+                            if 'FROM "posts_category"' in query['sql']]
+        self.assertEqual(len(category_queries), 1)
+
+    def test_unknown_category_creates_nothing(self):
+        response = self.client.post(
+            '/api/posts/', self.form(selectedCategories=['django', 'vue']), format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Post.objects.exists())
+
+    def test_update_replaces_categories(self):
+        post = make_chain(self.author, 1)[0]
+        post.category.add(Category.objects.get(title='django'))
+        self.client.put('/api/posts/{}/'.format(post.id), self.form(
+            updateId=post.id, selectedCategories=['react']), format='json')
+        self.assertEqual([category.title for category in post.category.all()], ['react'])
+
+
+class ImportPostsTest(TestCase):
+    def test_import(self):
+        User.objects.create(username='author')
+        rows = [
+            {'title': 'Post {}'.format(i), 'overview': 'overview', 'content': 'content',
+             'author': 'author', 'categories': ['django', 'react'][:i % 2 + 1],
+             'timestamp': '2020-01-0{}T00:00:00Z'.format(i + 1)}
+            for i in range(5)
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as f:
+            f.write('\n'.join(json.dumps(row) for row in rows))
+            f.flush()
+            # in bulk on every database, never post by post
+            with mock.patch.object(Post, 'save', side_effect=AssertionError):
+                call_command('import_posts', f.name, '--chunk-size', '2', stdout=StringIO())
+
+        self.assertEqual(Post.objects.count(), 5)
+        self.assertEqual(PostSearch.objects.count(), 5)
+        self.assertEqual(Category.objects.count(), 2)
+        self.assertEqual(Post.category.through.objects.count(), 7)
+        post = Post.objects.get(title='Post 3')
+        self.assertEqual(post.timestamp.day, 4)
+        self.assertEqual(post.author.user.username, 'author')
+        self.assertEqual(post.word_count, 1)
+        self.assertEqual(post.previous_post.title, 'Post 2')
+
+
+class LikeViewTest(PostsAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+        self.posts = make_chain(self.author, 3)
+        self.url = '/api/posts/{}/like/'.format(self.posts[0].id)
+
+    def test_toggle(self):
+        response = self.client.post(self.url)
+        self.assertEqual((response.data['liked'], response.data['likes']), (True, 1))
+        response = self.client.post(self.url)
+        self.assertEqual((response.data['liked'], response.data['likes']), (False, 0))
+        self.assertFalse(Like.objects.exists())
+
+    def test_unknown_post(self):
+        self.assertEqual(self.client.post('/api/posts/abc/like/').status_code, 404)
+
+    def test_unlike_is_idempotent(self):
+        self.client.post(self.url)
+        self.client.delete(self.url)
+        response = self.client.delete(self.url)
+        self.assertEqual(response.data['likes'], 0)
+
+    def test_duplicate_like_is_ignored(self):
+        Like.objects.create(user=self.user, post=self.posts[0])
+        with mock.patch.object(Like.objects, 'filter') as like_filter:
+            # as if the other request inserted between the delete and insert
+            like_filter.return_value.delete.return_value = (0, {})
+            response = self.client.post(self.url)
+        self.assertEqual(response.data['likes'], 0)
+        self.assertEqual(Like.objects.count(), 1)
+
+    def test_liked_posts(self):
+        self.client.post(self.url)
+        ids = ','.join(str(post.id) for post in self.posts)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/posts/liked/?ids=' + ids)
+        self.assertEqual(response.data['liked'], [self.posts[0].id])
+
+
+class QueryPlanTest(TestCase):
+    def test_api_queries_use_indexes(self):
+        call_command('explain_queries', '--fail-on-scan', stdout=StringIO())
+
+    def test_full_scan_is_flagged(self):
+        scans, plan = find_full_scans(Post.objects.filter(overview='overview'))
+        self.assertEqual(scans, ['posts_post'])
+
+
+class PostSearchTest(PostsAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.django = Category.objects.create(title='django')
+        self.in_title = self.create_post('Caching querysets', 'overview', '<p>nothing</p>')
+        self.in_content = self.create_post(
+            'Another post', 'overview', '<p>We cache <b>querysets</b> here</p>')
+        self.in_title.category.add(self.django)
+
+    def create_post(self, title, overview, content):
+        return Post.objects.create(
+            title=title, overview=overview, content=content, author=self.author)
+
+    def search(self, query):
+        response = self.client.get('/api/posts/search/?' + query)
+        return [post['id'] for post in response.data['results']]
+
+    def test_ranking_and_prefixes(self):
+        self.assertEqual(self.search('q=querysets'), [self.in_title.id, self.in_content.id])
+        self.assertEqual(self.search('q=cach'), [self.in_title.id, self.in_content.id])
+        self.assertEqual(self.search('q=cache+here'), [self.in_content.id])
+        self.assertEqual(self.search('q=b'), [])
+        self.assertEqual(self.search('q='), [])
+
+    def test_filters(self):
+        self.assertEqual(self.search('q=querysets&category=django'), [self.in_title.id])
+        self.assertEqual(self.search('q=querysets&author=nobody'), [])
+
+    def test_index_follows_writes(self):
+        self.in_title.title = 'Renamed'
+        self.in_title.save()
+        self.in_content.delete()
+        self.assertEqual(self.search('q=caching'), [])
+        self.assertEqual(self.search('q=renamed'), [self.in_title.id])
+
+    def test_rebuild(self):
+        PostSearch.objects.all().delete()
+        self.assertEqual(self.search('q=querysets'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search('q=querysets'), [self.in_title.id, self.in_content.id])
+
+
+class CommentThreadTest(PostsAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+        self.post = make_chain(self.author, 1)[0]
+
+    def comment(self, parent=None):
+        data = {'comment': 'hi', 'blogId': self.post.id}
+        if parent is not None:
+            data['parentId'] = parent
+        response = self.client.post('/api/posts/{}/comments/'.format(self.post.id), data)
+        return response.data['id']
+
+    def test_threads(self):
+        first, second = self.comment(), self.comment()
+        reply = self.comment(first)
+        nested = self.comment(reply)
+        other = self.comment(second)
+
+        response = self.client.get('/api/posts/{}/comments/'.format(self.post.id))
+        threads = response.data['results']
+        self.assertEqual([comment['id'] for comment in threads], [second, first])
+        self.assertEqual([comment['reply_count'] for comment in threads], [1, 1])
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/comments/{}/replies/'.format(first))
+        replies = response.data['results']
+        self.assertEqual([comment['id'] for comment in replies], [reply, nested])
+        self.assertEqual([comment['depth'] for comment in replies], [1, 2])
+        self.assertNotIn(other, [comment['id'] for comment in replies])
+        self.assertEqual(self.client.get('/api/comments/abc/replies/').status_code, 404)
+
+    @override_settings(COMMENT_MAX_DEPTH=1)
+    def test_max_depth(self):
+        reply = self.comment(self.comment())
+        too_deep = self.comment(reply)
+        self.assertEqual(Comment.objects.get(id=too_deep).parent_id,
+                         Comment.objects.get(id=reply).parent_id)
+
+
+def make_image(width, height):
+    output = BytesIO()
+    Image.new('RGB', (width, height), 'red').save(output, 'PNG')
+    return ContentFile(output.getvalue(), name='upload.png')
+
+
+@override_settings(IMAGE_VARIANTS_SYNC=True, IMAGE_VARIANT_WIDTHS=[320, 640, 1280])
+class ImageVariantTest(PostsAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.post = make_chain(self.author, 1)[0]
+
+    def test_variants_made_on_upload(self):
+        self.post.thumbnail.save('upload.png', make_image(800, 400))
+        self.post.refresh_from_db()
+
+        response = self.client.get('/api/posts/{}/'.format(self.post.id))
+        sources = response.data['thumbnail_srcset']
+        # 1280 would upscale the 800px original
+        self.assertEqual([entry.split()[-1] for entry in sources['webp'].split(', ')],
+                         ['320w', '640w', '800w'])
+        self.assertTrue(sources['jpeg'].startswith('http://testserver/media/derivatives/'))
+
+    def test_same_image_is_not_processed_twice(self):
+        self.post.thumbnail.save('upload.png', make_image(400, 400))
+        self.post.refresh_from_db()
+        with mock.patch('posts.images.make_variants') as make_variants:
+            self.post.save()
+        make_variants.assert_not_called()
+
+        other = make_chain(self.author, 1)[0]
+        other.thumbnail.save('upload.png', make_image(400, 400))
+        other.refresh_from_db()
+        self.assertEqual(json.loads(other.thumbnail_variants)['webp'],
+                         json.loads(self.post.thumbnail_variants)['webp'])
+
+    def test_profile_images_and_backfill(self):
+        self.author.profile_image.save('me.png', make_image(100, 100), save=False)
+        Author.objects.filter(id=self.author.id).update(
+            profile_image=self.author.profile_image.name)
+
+        out = StringIO()
+        call_command('generate_image_variants', stdout=out)
+        self.assertIn('Made variants for 1 author images.', out.getvalue())
+
+        data = self.client.get('/api/posts/{}/'.format(self.post.id)).data
+        self.assertEqual(data['author']['profile_image_srcset']['webp'].split()[-1], '100w')
+
+
+class RenderedContentTest(PostsAPITestCase):
+    content = (
+        '<h2>Getting started</h2><p onclick="steal()">Install <b>it</b>'
+        '<script>alert(1)</script></p><a href="javascript:alert(1)">link</a>'
+        '<h3>Getting started</h3><p>Then run it.</p>'
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(
+            title='post', overview='overview', content=self.content, author=self.author)
+
+    def test_render(self):
+        self.assertEqual(
+            self.post.content_html,
+            '<h2 id="getting-started">Getting started</h2><p>Install <b>it</b></p>'
+            '<a>link</a><h3 id="getting-started-2">Getting started</h3><p>Then run it.</p>')
+        self.assertEqual(self.post.excerpt, 'Getting started Install it link Getting started Then run it.')
+        self.assertEqual(self.post.word_count, 10)
+        self.assertEqual(self.post.reading_time, 1)
+
+        data = self.client.get('/api/posts/{}/'.format(self.post.id)).data
+        self.assertEqual(data['toc'], [
+            {'level': 2, 'id': 'getting-started', 'title': 'Getting started'},
+            {'level': 3, 'id': 'getting-started-2', 'title': 'Getting started'},
+        ])
+
+    def test_unsafe_urls_are_dropped(self):
+        for url in ['java\tscript:alert(1)', 'jav\nascript:alert(1)', ' \x01javascript:alert(1)',
+                    'javascript&#58;alert(1)', '&#106;avascript:alert(1)', 'JaVaScRiPt:alert(1)',
+                    'data:text/html,hi', 'vbscript:msgbox(1)']:
+            html = render('<a href="{0}">a</a><img src="{0}">'.format(url))['content_html']
+            self.assertEqual(html, '<a>a</a><img>', url)
+
+        html = render('<a href="/posts/1/">a</a><a href="https://x.org/?a=b:c">b</a>'
+                      '<a href="mailto:me@x.org">c</a><a href="page#top:1">d</a>')['content_html']
+        self.assertEqual(html.count('href'), 4)
+
+    def test_unchanged_content_is_not_rendered_again(self):
+        with mock.patch('posts.rendering.render') as render:
+            self.post.title = 'renamed'
+            self.post.save()
+        render.assert_not_called()
+
+        self.post.content = '<p>new</p>'
+        self.post.save(update_fields=['content'])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.excerpt, 'new')
+
+    def test_render_posts_command(self):
+        Post.objects.filter(id=self.post.id).update(content_html='', content_hash='')
+        out = StringIO()
+        call_command('render_posts', stdout=out)
+        call_command('render_posts', stdout=out)
+        self.assertEqual(out.getvalue(), 'Rendered 1 posts.\nRendered 0 posts.\n')
+        self.post.refresh_from_db()
+        self.assertTrue(self.post.content_html.startswith('<h2'))
+
+
+def asgi_request(application, path, method='GET', headers=()):
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    path, _, query_string = path.partition('?')
+    scope = {'type': 'http', 'method': method, 'path': path,
+             'query_string': query_string.encode('ascii'),
+             'http_version': '1.1', 'headers': [(b'host', b'testserver')] + list(headers)}
+    return scope, receive, send, messages
+
+
+class ReadPathApplicationTest(APITransactionTestCase):
+    def setUp(self):
+        response_cache.cache.clear()
+        self.user = User.objects.create(username='author')
+        self.post = make_chain(Author.objects.create(user=self.user), 1)[0]
+        self.application = ReadPathApplication(get_wsgi_application())
+
+    def request(self, *args, **kwargs):
+        scope, receive, send, messages = asgi_request(self.application, *args, **kwargs)
+        asyncio.run(self.application(scope, receive, send))
+        return messages[0]['status'], b''.join(message.get('body', b'') for message in messages[1:])
+
+    def test_read_path_matches_wsgi(self):
+        for path in ['/api/posts/', '/api/posts/{}/'.format(self.post.id), '/api/categories/']:
+            response = self.client.get(path)
+            status, body = self.request(path)
+            self.assertEqual(status, response.status_code)
+            self.assertEqual(json.loads(body.decode('utf-8')), response.json())
+
+    def test_other_requests_fall_back(self):
+        with mock.patch('posts.asgi.run_wsgi') as run_wsgi:
+            status, _ = self.request('/api/posts/search/?q=post')
+            self.request('/api/posts/{}/like/'.format(self.post.id), method='POST')
+        run_wsgi.assert_not_called()
+        self.assertEqual(status, 200)
+
+    def test_missing_signing_key_is_fetched_once(self):
+        private_key, jwk = make_signing_key('key-1')
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as jwks_file:
+            json.dump({'keys': [jwk]}, jwks_file)
+            jwks_file.flush()
+            jwks_store.clear()
+            self.addCleanup(jwks_store.clear)
+            header = 'Bearer {}'.format(make_token(private_key, 'key-1')).encode('latin1')
+
+            async def concurrent_requests():
+                requests = [asgi_request(self.application, '/api/categories/',
+                                         headers=[(b'authorization', header)])
+                            for _ in range(5)]
+                await asyncio.gather(*[self.application(scope, receive, send)
+                                       for scope, receive, send, _ in requests])
+
+            with override_settings(JWKS_PATH=jwks_file.name), \
+                    mock.patch.object(jwks_store, '_load', wraps=jwks_store._load) as load:
+                asyncio.run(concurrent_requests())
+        self.assertEqual(load.call_count, 1)
+        self.assertTrue(jwks_store.has_cached_key('key-1'))
+
+
+class CategoryIndexTest(PostsAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+        self.django = Category.objects.create(title='django')
+        self.react = Category.objects.create(title='react')
+        self.posts = make_chain(self.author, 3)
+        for post in self.posts:
+            post.category.add(self.django)
+        self.posts[0].category.add(self.react)
+
+    def test_counts_follow_category_changes(self):
+        self.django.refresh_from_db()
+        self.assertEqual(self.django.post_count, 3)
+        self.assertEqual(self.django.latest_post_at, self.posts[-1].timestamp)
+
+        self.posts[-1].category.remove(self.django)
+        self.react.post_set.clear()
+        self.posts[1].delete()
+        self.assertEqual(
+            list(Category.objects.order_by('title').values_list('title', 'post_count')),
+            [('django', 1), ('react', 0)])
+
+        call_command('recount_posts', stdout=StringIO())
+        self.assertEqual(Category.objects.get(title='django').post_count, 1)
+
+    def test_category_list(self):
+        response = self.client.get('/api/categories/?ordering=posts')
+        self.assertEqual([(category['title'], category['post_count'])
+                          for category in response.data], [('django', 3), ('react', 1)])
+        self.assertEqual(self.client.get('/api/categories/?ordering=size').status_code, 404)
+
+    def test_category_posts(self):
+        url = '/api/categories/{}/posts/'.format(self.django.id)
+        with self.assertNumQueries(4):
+            response = self.client.get(url + '?page_size=2')
+        self.assertEqual([post['id'] for post in response.data['results']],
+                         [self.posts[2].id, self.posts[1].id])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([post['id'] for post in response.data['results']], [self.posts[0].id])
+        self.assertEqual(self.client.get('/api/categories/999/posts/').status_code, 404)
+
+    def test_retimestamped_post_moves_in_the_index(self):
+        url = '/api/categories/{}/posts/'.format(self.django.id)
+        post = self.posts[0]
+        post.timestamp = self.posts[-1].timestamp + timedelta(hours=1)
+        post.save()
+
+        response = self.client.get(url)
+        self.assertEqual([row['id'] for row in response.data['results']],
+                         [post.id, self.posts[2].id, self.posts[1].id])
+        self.django.refresh_from_db()
+        self.react.refresh_from_db()
+        self.assertEqual(self.django.latest_post_at, post.timestamp)
+        self.assertEqual(self.react.latest_post_at, post.timestamp)
+
+
+class RequestMetricsTest(PostsAPITestCase):
+    def setUp(self):
+        super().setUp()
+        request_metrics.clear()
+        make_chain(self.author, 3)
+
+    def test_requests_are_recorded_by_url_name(self):
+        response = self.client.get('/api/posts/')
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="\d+ queries", serializer;dur=[\d.]+, total;dur=[\d.]+$')
+        self.client.get('/api/posts/')
+
+        stats = request_metrics.stats()['posts']
+        self.assertEqual(stats['count'], 2)
+        self.assertGreater(stats['queries']['p99'], 0)
+        # the second request is a cache hit
+        self.assertGreater(stats['serializer_ms']['p99'], 0)
+        self.assertLessEqual(stats['total_ms']['p50'], stats['total_ms']['p99'])
+
+    def test_metrics_endpoint_is_staff_only(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        self.client.get('/api/posts/')
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.data['requests']['posts']['count'], 1)
+        self.assertIn('posts', response.data['response_cache'])
+
+    def test_slow_requests_are_profiled(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with self.settings(REQUEST_PROFILE_SAMPLE_RATE=1.0, REQUEST_PROFILE_THRESHOLD_MS=0,
+                           REQUEST_PROFILE_DIR=directory):
+            self.client.get('/api/posts/')
+        profiles = os.listdir(directory)
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].startswith('posts-'))
+
+
+class BenchmarkCommandsTest(TestCase):
+    def test_generate_blog_and_run_benchmarks(self):
+        call_command('generate_blog', users=20, authors=3, categories=4, posts=30, likes=100,
+                     views=150, comments=60, sections=2, stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 30)
+        self.assertEqual(Like.objects.count(), 100)
+        self.assertEqual(Comment.objects.exclude(path='').count(), 60)
+        call_command('recount_posts', '--check', stdout=StringIO())
+
+        # every post is in its author's chain
+        for author in Author.objects.all():
+            posts = list(author.post_set.order_by('timestamp', 'id'))
+            self.assertEqual([post.next_post_id for post in posts[:-1]],
+                             [post.id for post in posts[1:]])
+
+        out = StringIO()
+        call_command('run_benchmarks', iterations=2, warmup=0, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['routes']), {pattern.name for pattern in urls.urlpatterns})
+        self.assertEqual(report['routes']['posts']['status'], [200])
+        self.assertGreater(report['routes']['post-detail']['bytes']['max'], 0)
+
+
+@override_settings(ENGAGEMENT_ROLLUP_LAG=0)
+class EngagementTest(PostsAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.posts = make_chain(self.author, 3)
+
+    def log(self, post, kind, count, hours_ago=0):
+        timestamp = timezone.now() - timedelta(hours=hours_ago)
+        EngagementEvent.objects.bulk_create(
+            [EngagementEvent(post=post, kind=kind, timestamp=timestamp) for _ in range(count)])
+
+    def test_views_are_logged(self):
+        self.client.get('/api/posts/{}/'.format(self.posts[0].id))
+        self.assertEqual(list(EngagementEvent.objects.values_list('post', 'kind', 'user')),
+                         [(self.posts[0].id, EngagementEvent.VIEW, None)])
+
+    def test_rollup_counts_each_event_once(self):
+        self.log(self.posts[0], EngagementEvent.VIEW, 3)
+        self.log(self.posts[0], EngagementEvent.LIKE, 1, hours_ago=2)
+        call_command('rollup_engagement', batch_size=2, stdout=StringIO())
+        self.log(self.posts[0], EngagementEvent.COMMENT, 1)
+        call_command('rollup_engagement', stdout=StringIO())
+        call_command('rollup_engagement', stdout=StringIO())
+
+        hourly = HourlyEngagement.objects.order_by('start')
+        self.assertEqual([(row.views, row.likes, row.comments) for row in hourly],
+                         [(0, 1, 0), (3, 0, 1)])
+        self.assertEqual(sum(DailyEngagement.objects.values_list('views', flat=True)), 3)
+
+    @override_settings(ENGAGEMENT_ROLLUP_LAG=60)
+    def test_rollup_waits_for_late_batches(self):
+        now = timezone.now()
+        # a batch with lower ids that is visible after a later one
+        self.log(self.posts[0], EngagementEvent.VIEW, 1)
+        self.log(self.posts[0], EngagementEvent.LIKE, 1, hours_ago=1)
+        self.assertEqual(roll_up(now=now), 0)
+        self.assertEqual(roll_up(now=now + timedelta(minutes=2)), 2)
+        self.assertEqual(roll_up(now=now + timedelta(minutes=2)), 0)
+
+    def test_trending_ranks_by_decayed_engagement(self):
+        self.log(self.posts[0], EngagementEvent.VIEW, 3)
+        # a like is worth 5 views, halved every 6 hours
+        self.log(self.posts[1], EngagementEvent.LIKE, 1, hours_ago=2)
+        self.log(self.posts[2], EngagementEvent.LIKE, 1, hours_ago=12)
+        self.log(self.posts[2], EngagementEvent.UNLIKE, 1, hours_ago=12)
+        call_command('rollup_engagement', stdout=StringIO())
+
+        response = self.client.get('/api/posts/trending/')
+        self.assertEqual([(post['id'], post['score']) for post in response.data['results']],
+                         [(self.posts[1].id, 3.969), (self.posts[0].id, 3.0)])
+        self.assertEqual(self.client.get('/api/posts/trending/?window=year').status_code, 404)
+
+
+class RelatedPostsTest(PostsAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+        self.reader = User.objects.create(username='reader')
+        django, react = Category.objects.create(title='django'), Category.objects.create(title='react')
+        self.posts = make_chain(self.author, 4)
+        for post, category in zip(self.posts, [django, react, react, django]):
+            post.category.add(category)
+        for user, posts in [(self.user, self.posts[:2]), (self.reader, self.posts[:3])]:
+            for post in posts:
+                PostView.objects.create(user=user, post=post)
+
+    def related(self, post):
+        return list(RelatedPost.objects.filter(post=post).order_by('rank').values_list(
+            'related', flat=True))
+
+    def test_related_posts_are_precomputed(self):
+        call_command('compute_related_posts', workers=1, chunk_size=3, stdout=StringIO())
+        # viewed by both readers, then by one, then the same category
+        self.assertEqual(self.related(self.posts[0]),
+                         [self.posts[1].id, self.posts[2].id, self.posts[3].id])
+        self.assertEqual(self.related(self.posts[3]), [self.posts[0].id])
+
+        rows = list(RelatedPost.objects.order_by('post', 'rank').values_list('post', 'related', 'score'))
+        call_command('compute_related_posts', workers=2, chunk_size=1, stdout=StringIO())
+        self.assertEqual(
+            list(RelatedPost.objects.order_by('post', 'rank').values_list('post', 'related', 'score')),
+            rows)
+
+    @override_settings(RELATED_CATEGORY_CANDIDATES=1)
+    def test_only_the_latest_posts_of_a_category_are_candidates(self):
+        call_command('compute_related_posts', workers=1, stdout=StringIO())
+        self.assertEqual(self.related(self.posts[0]),
+                         [self.posts[1].id, self.posts[2].id, self.posts[3].id])
+        # the latest django post, and not viewed with anything
+        self.assertEqual(self.related(self.posts[3]), [])
+
+    def test_detail_and_recommendations_read_the_table(self):
+        call_command('compute_related_posts', workers=1, count=2, stdout=StringIO())
+        response = self.client.get('/api/posts/{}/'.format(self.posts[0].id))
+        self.assertEqual([post['id'] for post in response.data['related_posts']],
+                         [self.posts[1].id, self.posts[2].id])
+        self.assertEqual(set(response.data['related_posts'][0]),
+                         {'id', 'title', 'thumbnail', 'timestamp'})
+
+        # related to what the user read, minus what they read
+        call_command('compute_related_posts', workers=1, stdout=StringIO())
+        response = self.client.get('/api/users/recommended/')
+        self.assertEqual([(post['id'], post['score']) for post in response.data['results']],
+                         [(self.posts[2].id, 1.914), (self.posts[3].id, 0.5)])
+
+
+class PostChainTest(TestCase):
+    def setUp(self):
+        self.author = Author.objects.create(user=User.objects.create(username='author'))
+        self.posts = make_chain(self.author, 4)
+
+    def chain(self, posts):
+        # (previous, next) of each post, as stored
+        links = {post_id: (previous_id, next_id) for post_id, previous_id, next_id in
+                 Post.objects.values_list('id', 'previous_post_id', 'next_post_id')}
+        return [links[post.id] for post in posts]
+
+    def expected(self, posts):
+        ids = [None] + [post.id for post in posts] + [None]
+        return list(zip(ids, ids[2:]))
+
+    def test_creates_and_deletes_relink_neighbours(self):
+        self.assertEqual(self.chain(self.posts), self.expected(self.posts))
+        self.posts[1].delete()
+        posts = [self.posts[0]] + self.posts[2:]
+        self.assertEqual(self.chain(posts), self.expected(posts))
+
+    def test_moved_posts_are_relinked(self):
+        post = self.posts[2]
+        post.timestamp = self.posts[0].timestamp - timedelta(days=1)
+        post.save()
+        posts = [post] + self.posts[:2] + self.posts[3:]
+        self.assertEqual(self.chain(posts), self.expected(posts))
+
+        post.author = Author.objects.create(user=User.objects.create(username='other'))
+        post.save(update_fields=['author'])
+        posts.remove(post)
+        self.assertEqual(self.chain(posts + [post]), self.expected(posts) + [(None, None)])
+
+    def test_stale_instances_keep_links(self):
+        newest = Post.objects.create(title='Post', overview='overview', content='content',
+                                     author=self.author)
+        self.posts[-1].title = 'Renamed'
+        self.posts[-1].save()
+        self.assertEqual(self.chain(self.posts[-1:]), [(self.posts[-2].id, newest.id)])
+
+    @override_settings(POST_LINKS_PER_CATEGORY=True)
+    def test_category_chains_and_relink_command(self):
+        django, react = Category.objects.create(title='django'), Category.objects.create(title='react')
+        for post, category in zip(self.posts, [django, react, django, react]):
+            post.category.add(category)
+        self.assertEqual(self.chain(self.posts[0::2]), self.expected(self.posts[0::2]))
+        self.assertEqual(self.chain(self.posts[1::2]), self.expected(self.posts[1::2]))
+
+        Post.objects.update(previous_post=None, next_post=None)
+        call_command('relink_posts', stdout=StringIO())
+        self.assertEqual(self.chain(self.posts[1::2]), self.expected(self.posts[1::2]))
+        with self.settings(POST_LINKS_PER_CATEGORY=False):
+            call_command('relink_posts', stdout=StringIO())
+        self.assertEqual(self.chain(self.posts), self.expected(self.posts))
+
+    @override_settings(POST_LINKS_PER_CATEGORY=True)
+    def test_incremental_links_match_relink(self):
+        django, react = Category.objects.create(title='django'), Category.objects.create(title='react')
+        self.posts[0].category.add(django)
+        self.posts[1].category.add(react, django)
+        self.posts[2].category.add(react)
+        self.posts[3].category.add(django, react)
+        self.posts[1].category.remove(django)
+        links = self.chain(self.posts)
+
+        # the bulk rebuild finds nothing to change
+        self.assertEqual(relink_chains(), 0)
+        self.assertEqual(self.chain(self.posts), links)
+        # first categories: django, react, react, django
+        self.assertEqual(links, [(None, self.posts[3].id), (None, self.posts[2].id),
+                                 (self.posts[1].id, None), (self.posts[0].id, None)])
@@ -1,7 +1,12 @@
+from django.conf import settings
 from django.contrib.auth import authenticate
+from collections import OrderedDict
+import hashlib
 import json
 import jwt
 import requests
+import threading
+import time
 
 
 def jwt_get_username_from_payload_handler(payload):
@@ -10,17 +15,165 @@ def jwt_get_username_from_payload_handler(payload):
     return username
 
 
+class JWKSKeyStore:
+    # Process-wide cache of the parsed Auth0 signing keys, indexed by kid.
+    # Keys are refreshed once the TTL has passed, or once when a token
+    # carries a kid we haven't seen yet (key rotation). Only one thread
+    # fetches at a time, the others wait for it and reuse its result.
+
+    def __init__(self, url=None, path=None, ttl=None, min_refresh_interval=None):
+        self.url = url
+        self.path = path
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self._keys = {}
+        self._fetched_at = None
+        self._lock = threading.Lock()
+
+    def _setting(self, name, default=None):
+        value = getattr(self, name)
+        if value is None:
+            value = getattr(settings, 'JWKS_' + name.upper(), default)
+        return value
+
+    def _load(self):
+        path = self._setting('path')
+        if path:
+            with open(path) as f:
+                return json.load(f)
+        return requests.get(self._setting('url'), timeout=5).json()
+
+    def _is_stale(self):
+        if self._fetched_at is None:
+            return True
+        return time.monotonic() - self._fetched_at > self._setting('ttl', 3600)
+
+    def refresh(self, force=False):
+        fetched_at = self._fetched_at
+        with self._lock:
+            # another thread refreshed while we were waiting for the lock
+            if self._fetched_at != fetched_at and not self._is_stale():
+                return
+            if not force and not self._is_stale():
+                return
+            if force and self._fetched_at is not None:
+                elapsed = time.monotonic() - self._fetched_at
+                if elapsed < self._setting('min_refresh_interval', 30):
+                    return
+
+            keys = {}
+            for jwk in self._load()['keys']:
+                keys[jwk['kid']] = jwt.algorithms.RSAAlgorithm.from_jwk(
+                    json.dumps(jwk))
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+
+    def get_key(self, kid):
+        if self._is_stale():
+            self.refresh()
+
+        public_key = self._keys.get(kid)
+        if public_key is None:
+            # unknown kid, the signing keys may have been rotated
+            self.refresh(force=True)
+            public_key = self._keys.get(kid)
+        return public_key
+
+    def has_cached_key(self, kid):
+        # whether get_key(kid) can answer without a fetch
+        return not self._is_stale() and kid in self._keys
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = None
+
+
+jwks_store = JWKSKeyStore()
+
+
+class VerifiedTokenCache:
+    # Bounded LRU of already verified claims, keyed by a hash of the token
+    # so raw bearer tokens are never kept in memory. An entry is dropped
+    # as soon as the token's exp has passed.
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _max_size(self):
+        if self.max_size is not None:
+            return self.max_size
+        return getattr(settings, 'JWT_TOKEN_CACHE_SIZE', 1024)
+
+    @staticmethod
+    def _key(token):
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+        return hashlib.sha256(token).hexdigest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                claims, expires_at = entry
+                if expires_at is None or expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return claims
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, token, claims):
+        max_size = self._max_size()
+        if max_size <= 0:
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (claims, claims.get('exp'))
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+token_cache = VerifiedTokenCache()
+
+
 def jwt_decode_token(token):
+    claims = token_cache.get(token)
+    if claims is not None:
+        return claims
+
     header = jwt.get_unverified_header(token)
-    jwks = requests.get(
-        'https://{}/.well-known/jwks.json'.format('dev-7jqnzazt.auth0.com')).json()
-    public_key = None
-    for jwk in jwks['keys']:
-        if jwk['kid'] == header['kid']:
-            public_key = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwk))
+    public_key = jwks_store.get_key(header.get('kid'))
 
     if public_key is None:
         raise Exception('Public key not found.')
 
-    issuer = 'https://{}/'.format('dev-7jqnzazt.auth0.com')
-    return jwt.decode(token, public_key, audience='https://myblog/api', issuer=issuer, algorithms=['RS256'])
+    claims = jwt.decode(
+        token,
+        public_key,
+        audience=settings.JWT_AUTH['JWT_AUDIENCE'],
+        issuer=settings.JWT_AUTH['JWT_ISSUER'],
+        algorithms=[settings.JWT_AUTH['JWT_ALGORITHM']]
+    )
+    token_cache.set(token, claims)
+    return claims